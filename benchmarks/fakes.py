@@ -0,0 +1,292 @@
+import asyncio
+import base64
+import hashlib
+import random
+import shutil
+import subprocess
+import threading
+import time
+import types
+
+import yt_dlp
+
+# Offline stand-ins for yt-dlp and Discord used by the benchmark harness.
+# Nothing here talks to the network.
+
+
+# Makes a short local audio file to "download" and play. Uses ffmpeg when it's
+# installed (a real Opus file), otherwise just writes placeholder bytes.
+def generate_audio_file(path, seconds=5):
+    if shutil.which("ffmpeg"):
+        subprocess.run(
+            ["ffmpeg", "-loglevel", "error", "-y", "-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}",
+             "-c:a", "libopus", "-b:a", "64k", path],
+            check=True,
+        )
+    else:
+        with open(path, "wb") as f:
+            f.write(b"\0" * 16000 * seconds)
+    return path
+
+
+# Replaces yt_dlp.YoutubeDL. Every extraction sleeps for `latency` seconds (plus jitter),
+# queries containing "playlist" return `playlist_size` flat entries paged like YouTube,
+# and `failure_rate` of extractions raise DownloadError.
+class FakeExtractor:
+    latency = 0.2
+    jitter = 0.05
+    playlist_size = 20
+    page_size = 100
+    page_latency = 0.1
+    failure_rate = 0.0
+    audio_file = None
+    calls = 0
+    lock = threading.Lock()
+
+    def __init__(self, params=None):
+        self.params = params or {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    @classmethod
+    def configure(cls, **options):
+        for name, value in options.items():
+            setattr(cls, name, value)
+        cls.calls = 0
+
+    def wait(self, seconds):
+        with FakeExtractor.lock:
+            FakeExtractor.calls += 1
+        time.sleep(max(0, seconds + random.uniform(-self.jitter, self.jitter)))
+        if random.random() < self.failure_rate:
+            raise yt_dlp.utils.DownloadError("fake extractor failure")
+
+    @staticmethod
+    def video_id(query):
+        return query.rsplit("=", 1)[-1].rsplit(":", 1)[-1].replace(" ", "_")
+
+    def video_info(self, query):
+        video_id = self.video_id(query)
+        return {
+            "_type": "video",
+            "id": video_id,
+            "extractor_key": "Youtube",
+            "title": f"Benchmark track {video_id}",
+            "duration": 5,
+            "webpage_url": f"https://www.youtube.com/watch?v={video_id}",
+            "url": self.audio_file,
+            "protocol": "https",
+            "acodec": "opus",
+            "ext": "webm",
+        }
+
+    # 11-character IDs like YouTube's, so URLs go through the same key lookup as real ones
+    @staticmethod
+    def make_id(name):
+        return base64.urlsafe_b64encode(hashlib.md5(name.encode()).digest()).decode()[:11]
+
+    def entries(self, query):
+        name = self.video_id(query)
+        for index in range(self.playlist_size):
+            if index and index % self.page_size == 0:
+                time.sleep(self.page_latency)
+            video_id = self.make_id(f"{name}-{index}")
+            yield {
+                "_type": "url",
+                "ie_key": "Youtube",
+                "id": video_id,
+                "title": f"Benchmark track {video_id}",
+                "url": f"https://www.youtube.com/watch?v={video_id}",
+            }
+
+    def extract_info(self, query, download=False, process=True):
+        self.wait(self.latency)
+        if "playlist" in query:
+            return {"_type": "playlist", "id": self.video_id(query), "entries": self.entries(query)}
+        if query.startswith("ytsearch:"):
+            return {"_type": "playlist", "entries": [self.video_info(query)]}
+        return self.video_info(query)
+
+    def process_ie_result(self, info, download=True):
+        if download:
+            self.wait(self.latency)
+            filename = self.params["outtmpl"].replace("%(ext)s", "opus")
+            shutil.copyfile(self.audio_file, filename)
+        return info
+
+    @staticmethod
+    def sanitize_info(info):
+        return dict(info)
+
+
+# Audio source that doesn't start FFmpeg
+class FakeSource:
+    def __init__(self, location, **options):
+        self.location = location
+
+    def read(self):
+        return b"\0" * 3840
+
+    def cleanup(self):
+        pass
+
+
+class FakeMessage:
+    def __init__(self, content):
+        self.content = content
+
+    async def edit(self, content=None, **kwargs):
+        self.content = content
+
+
+# Plays a track by waiting `track_seconds` (reading the source every 20ms in a
+# thread when `read_source` is set, like discord.py's AudioPlayer) and then
+# calling the after callback.
+class FakeVoiceClient:
+    track_seconds = 1.0
+    read_source = False
+
+    def __init__(self, guild, channel, recorder):
+        self.guild = guild
+        self.channel = channel
+        self.recorder = recorder
+        self.loop = asyncio.get_running_loop()
+        self.playing = False
+        self.connected = True
+        self.handle = None
+        self.after = None
+        self.stop_event = threading.Event()
+
+    def play(self, source, after=None):
+        self.recorder.first_audio(self.guild.id)
+        self.playing = True
+        self.after = after
+        self.stop_event = threading.Event()
+        if self.read_source:
+            threading.Thread(target=self.read_loop, args=(source, self.stop_event), daemon=True).start()
+        else:
+            self.handle = self.loop.call_later(self.track_seconds, self.finish)
+
+    def read_loop(self, source, stop_event):
+        end = time.monotonic() + self.track_seconds
+        while time.monotonic() < end and not stop_event.is_set():
+            if not source.read():
+                break
+            time.sleep(0.02)
+        source.cleanup()
+        self.loop.call_soon_threadsafe(self.finish)
+
+    def finish(self):
+        if not self.playing:
+            return
+        self.playing = False
+        if self.after:
+            self.after(None)
+
+    def is_playing(self):
+        return self.playing
+
+    def is_connected(self):
+        return self.connected
+
+    def stop(self):
+        self.stop_event.set()
+        if self.handle:
+            self.handle.cancel()
+        self.finish()
+
+    async def disconnect(self, force=False):
+        self.stop()
+        self.connected = False
+        self.guild.voice_client = None
+
+
+class FakeVoiceChannel:
+    def __init__(self, guild, recorder):
+        self.guild = guild
+        self.id = guild.id + 1000000
+        self.name = f"voice-{guild.id}"
+        self.members = [types.SimpleNamespace(bot=False, name="listener")]
+        self.recorder = recorder
+        self.bitrate = 64000
+
+    async def connect(self):
+        await asyncio.sleep(0.01)
+        voice = FakeVoiceClient(self.guild, self, self.recorder)
+        self.guild.voice_client = voice
+        return voice
+
+
+# send() records the message instead of calling Discord
+class FakeTextChannel:
+    def __init__(self, guild):
+        self.guild = guild
+        self.id = guild.id
+        self.name = "music"
+        self.messages = []
+
+    async def send(self, content=None, **kwargs):
+        message = FakeMessage(content)
+        self.messages.append(message)
+        return message
+
+
+class FakeGuild:
+    def __init__(self, guild_id, recorder):
+        self.id = guild_id
+        self.name = f"guild-{guild_id}"
+        self.voice_client = None
+        self.voice_channel = FakeVoiceChannel(self, recorder)
+        self.text_channel = FakeTextChannel(self)
+        self.member = types.SimpleNamespace(
+            id=1, name="bench-user", bot=False,
+            voice=types.SimpleNamespace(channel=self.voice_channel),
+        )
+
+    def get_channel(self, channel_id):
+        return self.text_channel if channel_id == self.text_channel.id else None
+
+    def get_member(self, member_id):
+        return self.member if member_id == self.member.id else None
+
+
+# Stands in for commands.Context, with the guild's music channel and listening member
+class FakeContext:
+    def __init__(self, guild):
+        self.guild = guild
+        self.author = guild.member
+        self.channel = guild.text_channel
+
+    @property
+    def messages(self):
+        return self.channel.messages
+
+    @property
+    def voice_client(self):
+        return self.guild.voice_client
+
+    async def send(self, content=None, **kwargs):
+        return await self.channel.send(content, **kwargs)
+
+
+class FakeBot:
+    def __init__(self, guilds):
+        self.loop = asyncio.get_running_loop()
+        self.guilds = guilds
+        self.guild_map = {guild.id: guild for guild in guilds}
+        self.user = types.SimpleNamespace(id=0, name="bench-bot")
+        self.latency = 0.05
+
+    def get_guild(self, guild_id):
+        return self.guild_map.get(guild_id)
+
+    def get_channel(self, channel_id):
+        guild = self.guild_map.get(channel_id)  # each fake guild's text channel shares its ID
+        return guild.text_channel if guild else None
+
+    def get_cog(self, name):
+        return None
@@ -0,0 +1,48 @@
+import argparse
+import os
+import sys
+import tracemalloc
+
+# Measures how much memory a queued track costs: builds a TrackQueue of Track
+# records like a playlist !play would and reports the traced bytes per track.
+#
+#   python -m benchmarks.track_memory --tracks 10000
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Memory per queued track")
+    parser.add_argument("--tracks", type=int, default=10000)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    from cogs.track import Track
+    from cogs.track_queue import TrackQueue
+
+    args = parse_args(argv)
+    # Built up front so only the records and queue bookkeeping are measured, not the
+    # title/URL strings (those come from yt-dlp either way)
+    songs = [(f"Benchmark track {index}", f"https://www.youtube.com/watch?v={index:011d}", 213)
+             for index in range(args.tracks)]
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    queue = TrackQueue(key=lambda track: track.url)
+    for title, url, duration in songs:
+        queue.put(Track(title, url, duration, 123456789012345678, 123456789012345679,
+                        123456789012345680, "bench-user"), duration)
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    track = queue[0]
+    print(f"tracks={len(queue)}")
+    print(f"Track record:           {sys.getsizeof(track)} bytes")
+    print(f"queued, incl. queue:    {used / len(queue):.0f} bytes/track")
+    return used / len(queue)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+# Offline benchmark for the Voice cog. Drives Voice.play, the per-guild audio player,
+# the preloader and download_song against a fake yt-dlp extractor and fake voice
+# clients, for a range of simulated guild counts.
+#
+#   python -m benchmarks.voice_bench --guilds 1,10,100,500 --tracks 3
+#
+# Reports per guild count: enqueue latency (command -> first track queued),
+# time-to-first-audio (command -> voice.play), event-loop lag and CPU per guild.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline Voice cog benchmark")
+    parser.add_argument("--guilds", default="1,10,50,100,500", help="comma-separated guild counts")
+    parser.add_argument("--tracks", type=int, default=3, help="tracks per guild (>1 queues a playlist)")
+    parser.add_argument("--mode", choices=("stream", "download"), default="stream")
+    parser.add_argument("--latency", type=float, default=0.2, help="fake extractor latency in seconds")
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--track-seconds", type=float, default=0.5, help="fake playback length per track")
+    parser.add_argument("--workers", type=int, default=4, help="extraction pool size")
+    parser.add_argument("--shared", action="store_true", help="every guild queues the same playlist")
+    parser.add_argument("--ffmpeg", action="store_true", help="open real FFmpeg sources (needs ffmpeg)")
+    parser.add_argument("--timeout", type=float, default=300, help="give up on a scenario after this long")
+    return parser.parse_args(argv)
+
+
+def percentile(values, pct):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+# Collects per-guild timestamps from the patched player and fake voice clients
+class Recorder:
+    def __init__(self, tracks):
+        self.tracks = tracks
+        self.started = {}
+        self.enqueued = {}
+        self.first_audio_at = {}
+        self.plays = {}
+        self.finished = set()
+        self.done = asyncio.Event()
+        self.expected = 0
+
+    def start(self, guild_id):
+        self.started[guild_id] = time.perf_counter()
+
+    def enqueue(self, guild_id):
+        self.enqueued.setdefault(guild_id, time.perf_counter())
+
+    def first_audio(self, guild_id):
+        self.first_audio_at.setdefault(guild_id, time.perf_counter())
+        self.plays[guild_id] = self.plays.get(guild_id, 0) + 1
+        if self.plays[guild_id] >= self.tracks:
+            self.finish(guild_id)
+
+    def finish(self, guild_id):
+        self.finished.add(guild_id)
+        if len(self.finished) >= self.expected:
+            self.done.set()
+
+    def latencies(self, stamps):
+        return [(stamps[g] - self.started[g]) * 1000 for g in stamps if g in self.started]
+
+
+async def measure_loop_lag(samples, interval=0.01):
+    loop = asyncio.get_running_loop()
+    while True:
+        before = loop.time()
+        await asyncio.sleep(interval)
+        samples.append((loop.time() - before - interval) * 1000)
+
+
+async def run_scenario(guild_count, args, audio_file):
+    from benchmarks.fakes import FakeBot, FakeContext, FakeExtractor, FakeGuild, FakeSource, FakeVoiceClient
+    from cogs import voice
+    from cogs.extractor import ExtractionEngine
+    from cogs.player import GuildPlayer
+
+    recorder = Recorder(args.tracks)
+    recorder.expected = guild_count
+    FakeVoiceClient.track_seconds = args.track_seconds
+    FakeVoiceClient.read_source = args.ffmpeg
+    FakeExtractor.configure(latency=args.latency, failure_rate=args.failure_rate,
+                            playlist_size=args.tracks, audio_file=audio_file)
+
+    guilds = [FakeGuild(guild_id, recorder) for guild_id in range(1, guild_count + 1)]
+    bot = FakeBot(guilds)
+    cog = voice.Voice(bot)
+    cog.extractor.shutdown()
+    cog.extractor = ExtractionEngine(mode="thread", workers=args.workers)
+    cog.stream_audio = args.mode == "stream"
+
+    original_enqueue = GuildPlayer.enqueue
+
+    async def enqueue(player, track, requested_at=None):
+        recorder.enqueue(player.guild_id)
+        return await original_enqueue(player, track, requested_at=requested_at)
+
+    GuildPlayer.enqueue = enqueue
+    if not args.ffmpeg:
+        GuildPlayer.create_source = staticmethod(lambda location, streamed, codec, bitrate, offset=0: FakeSource(location))
+
+    lag = []
+    lag_task = asyncio.get_running_loop().create_task(measure_loop_lag(lag))
+    contexts = [FakeContext(guild) for guild in guilds]
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+
+    async def request(ctx):
+        if args.tracks > 1:
+            name = "shared" if args.shared else f"guild{ctx.guild.id}"
+            search = f"https://www.youtube.com/playlist?list=bench-{name}"
+        else:
+            video_id = FakeExtractor.make_id("shared" if args.shared else f"guild{ctx.guild.id}")
+            search = f"https://www.youtube.com/watch?v={video_id}"
+        recorder.start(ctx.guild.id)
+        await voice.Voice.play.callback(cog, ctx, search=search)
+
+    try:
+        await asyncio.gather(*(request(ctx) for ctx in contexts))
+        try:
+            await asyncio.wait_for(recorder.done.wait(), timeout=args.timeout)
+        except asyncio.TimeoutError:
+            pass
+    finally:
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+        lag_task.cancel()
+        GuildPlayer.enqueue = original_enqueue
+        cog.cog_unload()
+
+    errors = sum(1 for ctx in contexts for message in ctx.messages
+                 if message.content and ("Error" in message.content or "❌" in message.content))
+    enqueue_ms = recorder.latencies(recorder.enqueued)
+    ttfa_ms = recorder.latencies(recorder.first_audio_at)
+    return {
+        "guilds": guild_count,
+        "enqueue_p50": percentile(enqueue_ms, 50),
+        "enqueue_p99": percentile(enqueue_ms, 99),
+        "ttfa_p50": percentile(ttfa_ms, 50),
+        "ttfa_p99": percentile(ttfa_ms, 99),
+        "lag_p50": percentile(lag, 50),
+        "lag_p99": percentile(lag, 99),
+        "lag_max": max(lag) if lag else float("nan"),
+        "cpu_ms_per_guild": cpu * 1000 / guild_count,
+        "wall_s": wall,
+        "completed": len(recorder.finished),
+        "errors": errors,
+        "extractions": FakeExtractor.calls,
+    }
+
+
+COLUMNS = [
+    ("guilds", "guilds", "{:d}"),
+    ("enqueue_p50", "enq p50 ms", "{:.1f}"),
+    ("enqueue_p99", "enq p99 ms", "{:.1f}"),
+    ("ttfa_p50", "ttfa p50 ms", "{:.1f}"),
+    ("ttfa_p99", "ttfa p99 ms", "{:.1f}"),
+    ("lag_p50", "lag p50 ms", "{:.2f}"),
+    ("lag_p99", "lag p99 ms", "{:.2f}"),
+    ("lag_max", "lag max ms", "{:.2f}"),
+    ("cpu_ms_per_guild", "cpu ms/guild", "{:.2f}"),
+    ("wall_s", "wall s", "{:.2f}"),
+    ("completed", "done", "{:d}"),
+    ("errors", "errors", "{:d}"),
+    ("extractions", "extracts", "{:d}"),
+]
+
+
+def format_table(results):
+    header = [title for _, title, _ in COLUMNS]
+    rows = [[fmt.format(result[key]) for key, _, fmt in COLUMNS] for result in results]
+    widths = [max(len(cell) for cell in column) for column in zip(header, *rows)]
+    lines = ["  ".join(cell.rjust(width) for cell, width in zip(header, widths))]
+    lines += ["  ".join(cell.rjust(width) for cell, width in zip(row, widths)) for row in rows]
+    return "\n".join(lines)
+
+
+async def main(argv=None):
+    args = parse_args(argv)
+    guild_counts = [int(count) for count in args.guilds.split(",") if count.strip()]
+
+    with tempfile.TemporaryDirectory(prefix="dbot-bench-") as workdir:
+        # Settings, caches and downloads all live in the temp dir, never in the repo
+        os.chdir(workdir)
+        import yt_dlp
+        from benchmarks.fakes import FakeExtractor, generate_audio_file
+        yt_dlp.YoutubeDL = FakeExtractor
+        audio_file = generate_audio_file(os.path.join(workdir, "bench_source.opus"))
+
+        results = []
+        for guild_count in guild_counts:
+            scenario_dir = os.path.join(workdir, f"guilds_{guild_count}")
+            os.makedirs(scenario_dir)
+            os.chdir(scenario_dir)
+            with contextlib.redirect_stdout(io.StringIO()):
+                results.append(await run_scenario(guild_count, args, audio_file))
+            print(f"finished {guild_count} guilds", file=sys.stderr)
+        os.chdir(ROOT)
+
+    print(f"mode={args.mode} tracks={args.tracks} latency={args.latency}s workers={args.workers} "
+          f"shared={args.shared} ffmpeg={args.ffmpeg}")
+    print(format_table(results))
+    return results
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,8 +1,15 @@
+import time
+STARTED_AT = time.perf_counter()  # start of imports, for the startup timing printed in on_ready
+
 import discord
 import logging
 import asyncio
+import os
 from discord.ext import commands
-from cogs.storage import get_log_channel_id, set_log_channel_id
+from cogs.storage import settings
+from cogs.log_sink import log_to_channel, log_sink
+
+IMPORTS_DONE_AT = time.perf_counter()
 
 
 logging.basicConfig(level=logging.INFO)
@@ -13,7 +20,23 @@ intents.messages = True
 intents.guilds = True
 intents.voice_states = True
 intents.members = True
-client = commands.Bot(command_prefix="!", intents=intents)
+
+# Sharding: by default every shard Discord recommends runs in this process.
+# cluster.py starts several processes and gives each one a range of shards.
+SHARD_COUNT = int(os.environ["SHARD_COUNT"]) if os.environ.get("SHARD_COUNT") else None
+SHARD_IDS = [int(shard_id) for shard_id in os.environ["SHARD_IDS"].split(",")] if os.environ.get("SHARD_IDS") else None
+
+class DBot(commands.AutoShardedBot):
+    # Save player state (for a warm restart) and deliver buffered log-channel messages
+    # before the connections go away
+    async def close(self):
+        voice = self.get_cog("Voice")
+        if voice:
+            voice.save_players()
+        await log_sink.flush()
+        await super().close()
+
+client = DBot(command_prefix="!", intents=intents, shard_count=SHARD_COUNT, shard_ids=SHARD_IDS)
 
 # Configure logging
 logger = logging.getLogger('discord_bot')
@@ -30,25 +53,36 @@ console_handler.setFormatter(formatter)
 # Add to logger
 logger.addHandler(console_handler)
 
+startup_times = {}  # step: seconds, printed once the bot is ready
+
 # Load extensions the correct async way
 @client.event
 async def on_ready():
-    print(f"{client.user} has connected to Discord!")
+    print(f"{client.user} has connected to Discord! (shards {sorted(client.shards)} of {client.shard_count})")
+    if startup_times and 'ready' not in startup_times:
+        startup_times['ready'] = time.perf_counter() - STARTED_AT
+        print("Startup: " + ", ".join(f"{step} {seconds:.2f}s" for step, seconds in startup_times.items()))
 
-# Use setup_hook to load cogs properly
+async def load_extension(ext):
+    started = time.perf_counter()
+    try:
+        await client.load_extension(ext)
+        print(f"Loaded {ext} in {time.perf_counter() - started:.2f}s")
+    except Exception as e:
+        print(f"Failed to load {ext}: {e}")
+
+# Use setup_hook to load cogs properly. The extensions don't depend on each
+# other, so they're loaded together.
 async def load_extensions():
-    extensions = ['cogs.commands', 'cogs.voice', 'cogs.log']
-    for ext in extensions:
-        try:
-            await client.load_extension(ext)
-            print(f"Loaded {ext}")
-        except Exception as e:
-            print(f"Failed to load {ext}: {e}")
+    extensions = ['cogs.commands', 'cogs.voice', 'cogs.log', 'cogs.stats', 'cogs.delete-messages']
+    started = time.perf_counter()
+    await asyncio.gather(*(load_extension(ext) for ext in extensions))
+    startup_times['imports'] = IMPORTS_DONE_AT - STARTED_AT
+    startup_times['extensions'] = time.perf_counter() - started
 
 @client.event
 async def on_command_error(ctx, error):
-    print(f"Error in {ctx.command}: {error}") # to terminal
-    await log_to_channel(client, ctx.guild, f"❌ Error in `{ctx.command}`: `{error}`") #in log channel
+    log_to_channel(client, ctx.guild, f"❌ Error in `{ctx.command}`: `{error}`") # in log channel and terminal
 
     if isinstance(error, commands.MissingRequiredArgument):
         if ctx.command.name == "play":
@@ -65,19 +99,17 @@ async def on_command_error(ctx, error):
         logger.error("Unhandled exception occurred", exc_info=True)
         raise error
 
-async def log_to_channel(bot, guild, message):
-    log_channel_id = get_log_channel_id(guild.id)
-    if log_channel_id:
-        channel = bot.get_channel(log_channel_id)
-        if channel:
-            await channel.send(message)
-            
 @client.event
 async def setup_hook():
     await load_extensions()
 
-# Load token from file
-with open("token.txt", "r") as file:
-    token = file.read().strip()
+# Guarded so extraction worker processes (which re-import this module) don't start a bot
+if __name__ == "__main__":
+    # Load token from file
+    with open("token.txt", "r") as file:
+        token = file.read().strip()
+
+    client.run(token)
 
-client.run(token)
+    # Write out any guild settings changed just before shutdown
+    settings.flush()
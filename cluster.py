@@ -0,0 +1,135 @@
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+
+# Runs the bot as several processes, each one connecting its own range of shards
+# and running its own voice players, so playback isn't limited to one core.
+#
+#   python cluster.py
+#
+# CLUSTER_PROCESSES sets the number of processes (default: one per CPU) and
+# SHARD_COUNT the total number of shards (default: what Discord recommends).
+# Guild settings are shared through the same JSON files / SQLite database; each
+# process gets its own audio cache directory and metrics port.
+
+CLUSTER_PROCESSES = int(os.environ.get("CLUSTER_PROCESSES", "0")) or os.cpu_count() or 1
+SHARD_COUNT = int(os.environ.get("SHARD_COUNT", "0"))
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9108"))
+IDENTIFY_INTERVAL = 5.0  # Discord allows one shard to connect per 5 seconds per concurrency bucket
+RESTART_DELAY = 5.0      # wait before restarting a process that exited
+GATEWAY_URL = "https://discord.com/api/v10/gateway/bot"
+
+
+def read_token():
+    with open("token.txt", "r") as file:
+        return file.read().strip()
+
+
+# Asks Discord how many shards to use and how many may connect at once
+def recommended_sharding(token):
+    request = urllib.request.Request(GATEWAY_URL, headers={
+        "Authorization": f"Bot {token}",
+        "User-Agent": "DiscordBot (dbot cluster launcher)",
+    })
+    with urllib.request.urlopen(request, timeout=30) as response:
+        data = json.load(response)
+    return data["shards"], data["session_start_limit"]["max_concurrency"]
+
+
+# Splits shards 0..shard_count-1 into `processes` contiguous ranges of near-equal size
+def split_shards(shard_count, processes):
+    processes = max(1, min(processes, shard_count))
+    size, extra = divmod(shard_count, processes)
+    ranges = []
+    start = 0
+    for index in range(processes):
+        end = start + size + (1 if index < extra else 0)
+        ranges.append(list(range(start, end)))
+        start = end
+    return ranges
+
+
+class Worker:
+    def __init__(self, cluster_id, shard_ids, shard_count):
+        self.cluster_id = cluster_id
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.process = None
+        self.restart_at = None
+
+    def environment(self):
+        env = dict(os.environ)
+        env["CLUSTER_ID"] = str(self.cluster_id)
+        env["SHARD_COUNT"] = str(self.shard_count)
+        env["SHARD_IDS"] = ",".join(str(shard_id) for shard_id in self.shard_ids)
+        env["AUDIO_CACHE_DIR"] = os.path.join("temp_music", f"cluster-{self.cluster_id}")
+        env["METRICS_PORT"] = str(METRICS_PORT + self.cluster_id) if METRICS_PORT else "0"
+        return env
+
+    def start(self):
+        print(f"Starting cluster {self.cluster_id} with shards {self.shard_ids[0]}-{self.shard_ids[-1]}")
+        self.process = subprocess.Popen([sys.executable, "bot.py"], env=self.environment())
+        self.restart_at = None
+
+    # SIGINT lets bot.py shut down cleanly and write out pending settings
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            if os.name == "nt":
+                self.process.terminate()
+            else:
+                self.process.send_signal(signal.SIGINT)
+
+
+def main():
+    if SHARD_COUNT:
+        shard_count, max_concurrency = SHARD_COUNT, 1
+    else:
+        shard_count, max_concurrency = recommended_sharding(read_token())
+    workers = [
+        Worker(cluster_id, shard_ids, shard_count)
+        for cluster_id, shard_ids in enumerate(split_shards(shard_count, CLUSTER_PROCESSES))
+    ]
+    print(f"Running {shard_count} shards across {len(workers)} processes")
+
+    stopping = False
+
+    def request_stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    # Stagger start-up so the processes don't exceed Discord's identify rate limit
+    for worker in workers:
+        if stopping:
+            break
+        worker.start()
+        time.sleep(IDENTIFY_INTERVAL * len(worker.shard_ids) / max_concurrency)
+
+    while not stopping:
+        now = time.monotonic()
+        for worker in workers:
+            if worker.process is None or worker.process.poll() is None:
+                continue
+            if worker.restart_at is None:
+                print(f"Cluster {worker.cluster_id} exited with code {worker.process.returncode}, restarting")
+                worker.restart_at = now + RESTART_DELAY
+            elif now >= worker.restart_at:
+                worker.start()
+        time.sleep(1)
+
+    print("Stopping clusters")
+    for worker in workers:
+        worker.stop()
+    for worker in workers:
+        if worker.process:
+            worker.process.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+INDEX_FILE = "index.json"
+AUDIO_EXTENSIONS = (".opus", ".mp3")  # finished downloads (.mp3 from before Opus passthrough)
+
+
+# Makes an extractor key like "Youtube-dQw4w9WgXcQ" safe to use as a filename
+def safe_filename(key):
+    return re.sub(r"[^\w.-]", "_", key)
+
+
+# Deletes files from disk, ignoring ones that are already gone. Meant to be
+# run through asyncio.to_thread so big cleanups don't block the event loop.
+def remove_files(paths):
+    removed = 0
+    for path in paths:
+        try:
+            os.remove(path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Could not remove {path}: {e}")
+    return removed
+
+
+# Persistent on-disk audio cache keyed by the extractor's video ID
+# (e.g. "Youtube-dQw4w9WgXcQ"), so the same video under a different URL is
+# still a hit. Entries are kept in least-recently-used order and the oldest
+# ones are evicted once the total size goes over max_bytes.
+#
+# Only index bookkeeping happens here; callers delete the returned paths and
+# write the index in a background thread.
+class AudioCache:
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(directory, INDEX_FILE)
+        self.tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        self.entries = OrderedDict()  # key: {"file": path, "size": bytes, "last_used": timestamp}
+        self.total_bytes = 0
+        self.version = 0  # bumped per snapshot, so an older snapshot never overwrites a newer one
+        self.saved_version = 0
+        self.save_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.index_path, "r") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            data = {}
+        except (OSError, ValueError) as e:
+            print(f"Audio cache index unreadable ({e}), rebuilding it from the files on disk")
+            data = self.scan()
+
+        # Oldest first so the most recently used entries end up at the back
+        for key, entry in sorted(data.items(), key=lambda item: item[1].get("last_used", 0)):
+            if os.path.exists(entry.get("file", "")):
+                self.entries[key] = entry
+                self.total_bytes += entry["size"]
+
+    # Index entries for the finished audio files in the directory, for when the index
+    # is lost. Keys come from the filenames (see safe_filename).
+    def scan(self):
+        data = {}
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            key, ext = os.path.splitext(name)
+            if ext in AUDIO_EXTENSIONS and os.path.isfile(path):
+                stat = os.stat(path)
+                data[key] = {"file": path, "size": stat.st_size, "last_used": stat.st_mtime}
+        return data
+
+    # Taken on the event loop thread; pass it to save() in a worker thread
+    def snapshot(self):
+        self.version += 1
+        return self.version, dict(self.entries)
+
+    # Writes the index atomically (and durably) so a crash mid-write can't corrupt it.
+    # Saves from several threads take turns, and one older than the last save is skipped.
+    def save(self, snapshot=None):
+        version, data = self.snapshot() if snapshot is None else snapshot
+        with self.save_lock:
+            if version <= self.saved_version:
+                return
+            with open(self.tmp_path, "w") as f:
+                json.dump(data, f, indent=4)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(self.tmp_path, self.index_path)
+            self.saved_version = version
+
+    def path_for(self, key, ext):
+        return os.path.join(self.directory, f"{safe_filename(key)}.{ext}")
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if not os.path.exists(entry["file"]):
+            self.discard(key)
+            return None
+        entry["last_used"] = time.time()
+        self.entries.move_to_end(key)
+        return entry["file"]
+
+    # Adds a downloaded file and returns the paths evicted to stay under budget
+    def add(self, key, path):
+        self.discard(key)
+        size = os.path.getsize(path)
+        self.entries[key] = {"file": path, "size": size, "last_used": time.time()}
+        self.total_bytes += size
+        return self.evict(keep=key)
+
+    def discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return None
+        self.total_bytes -= entry["size"]
+        return entry["file"]
+
+    def evict(self, keep=None):
+        evicted = []
+        while self.total_bytes > self.max_bytes and self.entries:
+            key = next(iter(self.entries))
+            if key == keep:
+                break
+            evicted.append(self.discard(key))
+        return evicted
+
+    # Forgets every entry and returns all files in the cache directory,
+    # including stray files that were never indexed
+    def clear(self):
+        self.entries.clear()
+        self.total_bytes = 0
+        return self.untracked_files()
+
+    # Files in the cache directory that aren't in the index (old temp files,
+    # interrupted downloads)
+    def untracked_files(self):
+        tracked = {entry["file"] for entry in self.entries.values()}
+        tracked.update((self.index_path, self.tmp_path))
+        paths = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if path not in tracked and os.path.isfile(path):
+                paths.append(path)
+        return paths
@@ -1,16 +1,81 @@
 import discord
+import asyncio
 from discord.ext import commands
+from cogs.storage import get_cleanup_channel_id, set_cleanup_channel_id
 
+CLEANUP_INTERVAL = 5.0   # seconds messages are collected before being deleted together
+BULK_DELETE_LIMIT = 100  # most messages Discord deletes in one bulk request
+MAX_BACKOFF = 60.0       # longest wait after repeated rate limits
+
+
+# Keeps a guild's cleanup channel (set with !setcleanupchannel) clear. New messages
+# there are collected by ID and deleted in bulk every few seconds, so a busy channel
+# costs one API call per 100 messages instead of a history fetch and a delete per
+# message. Each channel's janitor task exits once nothing is waiting.
 class DeleteMessages(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self.pending = {}  # channel_id: [message_id, ...]
+        self.janitors = {}  # channel_id: janitor task
 
+    def cog_unload(self):
+        for task in self.janitors.values():
+            task.cancel()
 
-    #Delete messages in d-bot-requests, might get rid of this
     @commands.Cog.listener()
     async def on_message(self, message):
-        if message.channel.name == "d-bot-requests" and message.content != "":
-            await message.channel.purge(limit=1)
+        if not message.guild or not message.content:
+            return
+        if message.channel.id != get_cleanup_channel_id(message.guild.id):
+            return
+
+        self.pending.setdefault(message.channel.id, []).append(message.id)
+        if message.channel.id not in self.janitors:
+            self.janitors[message.channel.id] = self.bot.loop.create_task(self.janitor(message.channel.id))
+
+    async def janitor(self, channel_id):
+        delay = CLEANUP_INTERVAL
+        try:
+            while True:
+                await asyncio.sleep(delay)
+                message_ids = self.pending.pop(channel_id, None)
+                if not message_ids:
+                    return
+
+                channel = self.bot.get_channel(channel_id)
+                if channel is None:
+                    return
+                for start in range(0, len(message_ids), BULK_DELETE_LIMIT):
+                    batch = message_ids[start:start + BULK_DELETE_LIMIT]
+                    try:
+                        await channel.delete_messages([discord.Object(id=message_id) for message_id in batch])
+                    except discord.Forbidden:
+                        print(f"Missing permission to delete messages in #{channel}")
+                        return
+                    except discord.NotFound:
+                        pass  # already deleted
+                    except discord.HTTPException as e:
+                        if e.status != 429:
+                            print(f"Failed to delete messages in #{channel}: {e}")
+                            continue
+                        # Still rate limited after discord.py's own retries: put the rest back and wait longer
+                        self.pending[channel_id] = message_ids[start:] + self.pending.get(channel_id, [])
+                        delay = min(MAX_BACKOFF, max(delay * 2, getattr(e, "retry_after", None) or 0))
+                        break
+                else:
+                    delay = CLEANUP_INTERVAL
+        finally:
+            if self.janitors.get(channel_id) is asyncio.current_task():
+                del self.janitors[channel_id]
+
+    @commands.command(name="setcleanupchannel")
+    @commands.has_permissions(administrator=True)
+    async def set_cleanup_channel(self, ctx, channel: discord.TextChannel = None):
+        set_cleanup_channel_id(ctx.guild.id, channel.id if channel else None)
+        if channel:
+            await ctx.send(f"🧹 Messages in {channel.mention} will now be cleaned up automatically.")
+        else:
+            await ctx.send("🧹 Automatic message cleanup is off.")
 
 async def setup(bot):
     await bot.add_cog(DeleteMessages(bot))
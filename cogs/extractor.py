@@ -0,0 +1,256 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+import weakref
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from cogs.metadata import compact_info
+from cogs.metrics import EXTRACTOR_WAIT_SECONDS
+
+# yt-dlp work runs in its own pool so it can't starve the event loop (and the gateway
+# heartbeat). EXTRACTOR_MODE=process uses worker processes, EXTRACTOR_MODE=thread a thread pool.
+EXTRACTOR_MODE = os.environ.get("EXTRACTOR_MODE", "process").lower()
+EXTRACTOR_WORKERS = int(os.environ.get("EXTRACTOR_WORKERS", "4"))          # jobs at once, all guilds
+EXTRACTOR_GUILD_LIMIT = int(os.environ.get("EXTRACTOR_GUILD_LIMIT", "2"))  # jobs at once per guild
+EXTRACT_TIMEOUT = float(os.environ.get("EXTRACT_TIMEOUT", "60"))
+DOWNLOAD_TIMEOUT = float(os.environ.get("DOWNLOAD_TIMEOUT", "600"))
+# Playlist/search listings have limits of their own, so a long listing never holds up
+# resolving and downloading the songs it found
+LISTING_WORKERS = int(os.environ.get("LISTING_WORKERS", "4"))          # listings at once, all guilds
+LISTING_GUILD_LIMIT = int(os.environ.get("LISTING_GUILD_LIMIT", "1"))  # listings at once per guild
+LISTING_IDLE_TIMEOUT = float(os.environ.get("LISTING_IDLE_TIMEOUT", "60"))  # longest wait for the next entry
+
+
+# Jobs are module-level functions so they can be sent to worker processes.
+# Results are sanitized into plain data so they can be pickled back.
+
+def extract_job(query, ydl_opts):
+    import yt_dlp
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(query, download=False)
+        if 'entries' in info:
+            info = info['entries'][0]
+        return compact_info(ydl.sanitize_info(info))
+
+
+def download_job(info, ydl_opts):
+    import yt_dlp
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        ydl.process_ie_result(dict(info), download=True)
+
+
+# Imports yt-dlp and loads its extractor list ahead of the first real job
+def warm_job():
+    from yt_dlp.extractor import gen_extractor_classes
+    return len(list(gen_extractor_classes()))
+
+
+# Runs yt-dlp jobs with a global and a per-guild concurrency limit and a timeout per job.
+# In process mode every slot has its own single-process worker, so a job that is
+# cancelled (!skip, !stop) or runs past its timeout is stopped by killing just its
+# worker, which is then replaced. Threads can't be stopped: in thread mode such a job
+# runs to the end and keeps its slots until then.
+class ExtractionEngine:
+    def __init__(self, mode=EXTRACTOR_MODE, workers=EXTRACTOR_WORKERS, guild_limit=EXTRACTOR_GUILD_LIMIT,
+                 listing_workers=LISTING_WORKERS, listing_guild_limit=LISTING_GUILD_LIMIT):
+        self.mode = mode
+        self.workers = workers
+        self.guild_limit = guild_limit
+        self.slots = asyncio.Semaphore(workers)
+        self.guild_slots = weakref.WeakValueDictionary()  # guild_id: semaphore, only while in use
+        self.listing_guild_limit = listing_guild_limit
+        self.listing_slots = asyncio.Semaphore(listing_workers)
+        self.listing_guild_slots = weakref.WeakValueDictionary()
+        if mode == "process":
+            self.idle_workers = [self.create_worker() for _ in range(workers)]
+            self.busy_workers = set()
+        else:
+            self.executor = ThreadPoolExecutor(workers, thread_name_prefix="ytdl")
+
+    # Stopping a job can be done (and is worth waiting for) only in process mode
+    @property
+    def can_stop_jobs(self):
+        return self.mode == "process"
+
+    @staticmethod
+    def create_worker():
+        return ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn"))
+
+    # A free slot always has a worker to go with it
+    def take_worker(self):
+        if self.mode != "process":
+            return self.executor
+        worker = self.idle_workers.pop()
+        self.busy_workers.add(worker)
+        return worker
+
+    def return_worker(self, worker):
+        if self.mode == "process" and worker in self.busy_workers:
+            self.busy_workers.discard(worker)
+            self.idle_workers.append(worker)
+
+    # Kills a worker in the middle of a job and puts a fresh one (importing yt-dlp
+    # ahead of its first job) in its place
+    def replace_worker(self, worker):
+        if self.mode != "process" or worker not in self.busy_workers:
+            return
+        self.busy_workers.discard(worker)
+        self.kill_workers(worker)
+        worker.shutdown(wait=False, cancel_futures=True)
+        fresh = self.create_worker()
+        fresh.submit(warm_job)
+        self.idle_workers.append(fresh)
+
+    @staticmethod
+    def guild_slot(guild_slots, limit, guild_id):
+        if guild_id is None:
+            return None
+        slot = guild_slots.get(guild_id)
+        if slot is None:
+            slot = asyncio.Semaphore(limit)
+            guild_slots[guild_id] = slot
+        return slot
+
+    async def acquire(self, guild_id, listing=False):
+        if listing:
+            slots = self.listing_slots
+            guild_slot = self.guild_slot(self.listing_guild_slots, self.listing_guild_limit, guild_id)
+        else:
+            slots = self.slots
+            guild_slot = self.guild_slot(self.guild_slots, self.guild_limit, guild_id)
+        if guild_slot is not None:
+            await guild_slot.acquire()
+        try:
+            await slots.acquire()
+        except BaseException:
+            if guild_slot is not None:
+                guild_slot.release()
+            raise
+
+        released = False
+
+        # Slots are given back when the job really finishes, not when the caller stops
+        # waiting, so abandoned jobs still count against the limits
+        def release():
+            nonlocal released
+            if released:
+                return
+            released = True
+            slots.release()
+            if guild_slot is not None:
+                guild_slot.release()
+
+        return release
+
+    # histogram, if given, gets the job's own run time (not the wait for a slot)
+    async def run(self, fn, *args, guild_id=None, timeout=EXTRACT_TIMEOUT, histogram=None):
+        loop = asyncio.get_running_loop()
+        waited_from = loop.time()
+        release = await self.acquire(guild_id)
+        started = loop.time()
+        EXTRACTOR_WAIT_SECONDS.observe(started - waited_from)
+        worker = self.take_worker()
+        try:
+            future = worker.submit(fn, *args)
+        except BaseException:
+            self.replace_worker(worker)
+            release()
+            raise
+        stopped = False
+
+        def finished():
+            if not stopped:
+                self.return_worker(worker)
+                if histogram is not None and not future.cancelled():
+                    histogram.observe(loop.time() - started)
+            release()
+
+        def done(f):
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(finished)
+
+        future.add_done_callback(done)
+
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if isinstance(e, asyncio.TimeoutError):
+                print(f"yt-dlp job {fn.__name__} timed out after {timeout}s")
+            if self.can_stop_jobs and not future.done():
+                stopped = True
+                self.replace_worker(worker)
+                release()
+            raise
+
+    # Runs a playlist listing: a blocking fn(touch) that reports entries back through the
+    # event loop (see Voice.iter_songs) and calls touch() whenever it makes progress.
+    # Listings need a thread in this process and count against the listing limits only.
+    # Callers stop one cooperatively; one that makes no progress for idle_timeout
+    # seconds is given up on (threads can't be killed) and its slots freed.
+    async def run_stream(self, fn, guild_id=None, idle_timeout=LISTING_IDLE_TIMEOUT):
+        loop = asyncio.get_running_loop()
+        release = await self.acquire(guild_id, listing=True)
+        finished = loop.create_future()
+        last_progress = time.monotonic()
+
+        def touch():
+            nonlocal last_progress
+            last_progress = time.monotonic()
+
+        def target():
+            try:
+                result = fn(touch)
+            except BaseException as e:
+                outcome = (finished.set_exception, e)
+            else:
+                outcome = (finished.set_result, result)
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(settle, *outcome)
+
+        def settle(set_outcome, value):
+            release()
+            if not finished.done():
+                set_outcome(value)
+
+        try:
+            threading.Thread(target=target, name="ytdl-list", daemon=True).start()
+        except BaseException:
+            release()
+            raise
+
+        while True:
+            idle = time.monotonic() - last_progress
+            if idle >= idle_timeout:
+                print(f"yt-dlp listing made no progress for {idle_timeout}s, giving up on it")
+                release()
+                raise asyncio.TimeoutError()
+            done, _ = await asyncio.wait({finished}, timeout=idle_timeout - idle)
+            if done:
+                return finished.result()
+
+    @staticmethod
+    def kill_workers(executor):
+        # ProcessPoolExecutor has no public way to stop a running job
+        for process in list((executor._processes or {}).values()):
+            if process.is_alive():
+                process.terminate()
+
+    # Starts the worker processes and has each one import yt-dlp. Threads share
+    # this process's imports, so there's nothing to do in thread mode.
+    async def warm_up(self):
+        if self.mode != "process":
+            return
+        loop = asyncio.get_running_loop()
+        jobs = [loop.run_in_executor(worker, warm_job) for worker in self.idle_workers]
+        await asyncio.gather(*jobs)
+
+    def shutdown(self):
+        if self.mode != "process":
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            return
+        for worker in self.busy_workers:
+            self.kill_workers(worker)
+        for worker in self.idle_workers + list(self.busy_workers):
+            worker.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,128 @@
+import discord
+import asyncio
+from cogs.storage import get_log_channel_id
+from cogs.metrics import DISCORD_SEND_SECONDS
+
+MAX_MESSAGE_LENGTH = 2000   # Discord's per-message limit
+FLUSH_INTERVAL = 2.0        # seconds events are collected before sending
+FLUSH_SIZE = 1800           # send early once this many characters are waiting
+SEND_INTERVAL = 1.0         # minimum gap between messages to the same log channel
+MAX_BUFFERED_LINES = 500    # drop the oldest events if a log channel can't keep up
+MAX_SEND_ATTEMPTS = 3
+
+
+# Packs lines into as few messages as possible without going over the length limit
+def pack_lines(lines, limit=MAX_MESSAGE_LENGTH):
+    chunks = []
+    current = ""
+    for line in lines:
+        line = line[:limit]
+        if current and len(current) + 1 + len(line) > limit:
+            chunks.append(current)
+            current = line
+        else:
+            current = f"{current}\n{line}" if current else line
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+# Background pipeline for log-channel messages. Events are buffered per guild and
+# sent as combined messages on a timer (or sooner when the buffer fills up), so
+# callers never wait on Discord. Each guild's flusher exits once its buffer is
+# empty, so quiet guilds cost nothing.
+class LogSink:
+    def __init__(self):
+        self.bot = None
+        self.buffers = {}  # guild_id: [line, ...]
+        self.sizes = {}    # guild_id: characters waiting
+        self.wakeups = {}  # guild_id: event set when the buffer is big enough to send early
+        self.flushers = {}  # guild_id: flusher task
+
+    def log(self, bot, guild, line):
+        self.bot = bot
+        buffer = self.buffers.setdefault(guild.id, [])
+        buffer.append(line)
+        self.sizes[guild.id] = self.sizes.get(guild.id, 0) + len(line) + 1
+        if len(buffer) > MAX_BUFFERED_LINES:
+            dropped = buffer.pop(0)
+            self.sizes[guild.id] -= len(dropped) + 1
+
+        if guild.id not in self.flushers:
+            self.wakeups[guild.id] = asyncio.Event()
+            self.flushers[guild.id] = asyncio.get_running_loop().create_task(self.flusher(guild.id))
+        if self.sizes[guild.id] >= FLUSH_SIZE:
+            self.wakeups[guild.id].set()
+
+    async def flusher(self, guild_id):
+        wakeup = self.wakeups[guild_id]
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(wakeup.wait(), timeout=FLUSH_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                wakeup.clear()
+
+                lines = self.buffers.pop(guild_id, None)
+                self.sizes.pop(guild_id, None)
+                if not lines:
+                    return
+
+                channel = self.get_channel(guild_id)
+                if channel is None:
+                    continue
+                for chunk in pack_lines(lines):
+                    await self.send(channel, chunk)
+                    await asyncio.sleep(SEND_INTERVAL)
+        finally:
+            if self.flushers.get(guild_id) is asyncio.current_task():
+                del self.flushers[guild_id]
+                del self.wakeups[guild_id]
+
+    def get_channel(self, guild_id):
+        log_channel_id = get_log_channel_id(guild_id)
+        if not log_channel_id or self.bot is None:
+            return None
+        return self.bot.get_channel(log_channel_id)
+
+    async def send(self, channel, content):
+        for attempt in range(1, MAX_SEND_ATTEMPTS + 1):
+            try:
+                with DISCORD_SEND_SECONDS.time():
+                    await channel.send(content, suppress_embeds=True)
+                return
+            except discord.HTTPException as e:
+                # discord.py already waits out normal rate limits; back off further if we still get a 429
+                if e.status == 429 and attempt < MAX_SEND_ATTEMPTS:
+                    await asyncio.sleep(getattr(e, "retry_after", None) or 2 ** attempt)
+                    continue
+                print(f"Failed to send log message to #{channel}: {e}")
+                return
+
+    # Sends whatever is still buffered, e.g. before shutting down
+    async def flush(self):
+        for wakeup in self.wakeups.values():
+            wakeup.set()
+        await asyncio.gather(*self.flushers.values(), return_exceptions=True)
+
+
+log_sink = LogSink()
+
+
+# Queues a message for the guild's log channel and echoes it to the terminal.
+# Returns immediately; delivery happens in the background.
+def log_to_channel(bot, guild, message, author_name=None):
+    # Construct the message with or without author_name
+    if author_name:
+        formatted_message = f"{message} by User: **{author_name}**"
+    else:
+        formatted_message = message
+
+    if guild is None:
+        print(formatted_message)
+        return
+
+    # Print to terminal with server name
+    print(f"{formatted_message} in Server: **{guild.name}**")
+    log_sink.log(bot, guild, formatted_message)
@@ -0,0 +1,95 @@
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse, parse_qs
+
+# How long resolved yt-dlp results stay usable
+SEARCH_TTL = 6 * 60 * 60       # "ytsearch:" term -> results
+PLAYLIST_TTL = 15 * 60         # playlist/URL -> entries, playlists change
+STREAM_TTL = 30 * 60           # resolved video info when the stream URL has no expiry hint
+STREAM_EXPIRY_MARGIN = 5 * 60  # stop using a stream URL this long before it expires
+
+# Parts of an info dict we never use but that make up most of its size
+HEAVY_INFO_KEYS = ("automatic_captions", "subtitles", "thumbnails", "heatmap", "description", "chapters")
+
+
+# Small LRU cache where every entry also expires after a time-to-live
+class TTLCache:
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key: (expires_at, value)
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            return
+        self.entries[key] = (time.monotonic() + ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def pop(self, key):
+        entry = self.entries.pop(key, None)
+        return entry[1] if entry else None
+
+    def clear(self):
+        self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+# Seconds until the resolved stream URL stops working, based on the "expire"
+# query parameter YouTube puts on its media URLs
+def stream_ttl(info):
+    url = info.get("url")
+    if not url:
+        return STREAM_TTL
+    expire = parse_qs(urlparse(url).query).get("expire")
+    if not expire:
+        return STREAM_TTL
+    try:
+        return int(expire[0]) - time.time() - STREAM_EXPIRY_MARGIN
+    except ValueError:
+        return STREAM_TTL
+
+
+# Drops the bulky fields so cached info dicts stay small
+def compact_info(info):
+    return {k: v for k, v in info.items() if k not in HEAVY_INFO_KEYS}
+
+
+# Shared yt-dlp metadata used by both !play and the stream/download path
+class MetadataCache:
+    def __init__(self):
+        self.queries = TTLCache(maxsize=1024, ttl=SEARCH_TTL)  # query: [(title, url), ...]
+        self.videos = TTLCache(maxsize=256, ttl=STREAM_TTL)    # video key: resolved info dict
+        self.url_keys = TTLCache(maxsize=4096, ttl=SEARCH_TTL)  # url: video key, for URLs without an offline key
+
+    def get_video(self, key):
+        return self.videos.get(key) if key else None
+
+    def add_video(self, url, info):
+        key = f"{info['extractor_key']}-{info['id']}"
+        self.videos.set(key, compact_info(info), ttl=stream_ttl(info))
+        self.url_keys.set(url, key)
+        for alias in (info.get("webpage_url"), info.get("original_url")):
+            if alias:
+                self.url_keys.set(alias, key)
+        return key
+
+    def clear(self):
+        self.queries.clear()
+        self.videos.clear()
+        self.url_keys.clear()
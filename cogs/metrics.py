@@ -0,0 +1,161 @@
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Small in-process metrics registry rendered in the Prometheus text format.
+# The Stats cog serves it over HTTP and summarizes it in !stats.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+RECENT_SAMPLES = 1024  # observations kept for the percentiles shown in !stats
+
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in zip(names, values))
+    return f"{{{pairs}}}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self.values = {}  # label values: count
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.label_names)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        key = tuple(labels.get(name, "") for name in self.label_names)
+        return self.values.get(key, 0)
+
+    def render(self):
+        for key, value in sorted(self.values.items()):
+            yield f"{self.name}{format_labels(self.label_names, key)} {value}"
+
+
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.value = 0
+        self.function = None
+
+    def set(self, value):
+        self.value = value
+
+    # Read the value from a callback at scrape time instead
+    def set_function(self, function):
+        self.function = function
+
+    def get(self):
+        return self.function() if self.function else self.value
+
+    def render(self):
+        yield f"{self.name} {self.get()}"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.bucket_counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.bucket_counts[index] += 1
+                break
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def percentile(self, pct):
+        if not self.recent:
+            return None
+        values = sorted(self.recent)
+        return values[min(len(values) - 1, int(pct / 100 * len(values)))]
+
+    def render(self):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.bucket_counts):
+            cumulative += count
+            yield f'{self.name}_bucket{{le="{bound}"}} {cumulative}'
+        yield f'{self.name}_bucket{{le="+Inf"}} {self.count}'
+        yield f"{self.name}_sum {self.sum}"
+        yield f"{self.name}_count {self.count}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self.add(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text):
+        return self.add(Gauge(name, help_text))
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        return self.add(Histogram(name, help_text, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+EXTRACT_SECONDS = registry.histogram("dbot_extract_seconds", "yt-dlp extract_info time per video")
+DOWNLOAD_SECONDS = registry.histogram("dbot_download_seconds", "yt-dlp download + postprocess time per track")
+EXTRACTOR_WAIT_SECONDS = registry.histogram("dbot_extractor_wait_seconds", "Time yt-dlp jobs waited for an extraction slot")
+FFMPEG_START_SECONDS = registry.histogram("dbot_ffmpeg_start_seconds", "Time to start an FFmpeg audio source")
+QUEUE_WAIT_SECONDS = registry.histogram("dbot_queue_wait_seconds", "Time a track spent queued before playing")
+TIME_TO_FIRST_AUDIO_SECONDS = registry.histogram("dbot_time_to_first_audio_seconds", "!play to first audio of the request")
+DISCORD_SEND_SECONDS = registry.histogram("dbot_discord_send_seconds", "Latency of messages sent to Discord")
+LOOP_LAG_SECONDS = registry.histogram(
+    "dbot_event_loop_lag_seconds", "How late the event loop runs a scheduled wakeup",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5),
+)
+CACHE_REQUESTS = registry.counter("dbot_cache_requests_total", "Cache lookups by cache and result", labels=("cache", "result"))
+PREFETCH_RESULTS = registry.counter("dbot_prefetch_total", "Tracks that were ready (hit) or not (miss) when due", labels=("result",))
+VOICE_CONNECTIONS = registry.gauge("dbot_voice_connections", "Connected voice clients")
+ACTIVE_PLAYERS = registry.gauge("dbot_active_players", "Guilds with a music player")
+
+
+def cache_lookup(cache, hit):
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def hit_ratio(counter, **labels):
+    hits = counter.get(result="hit", **labels)
+    total = hits + counter.get(result="miss", **labels)
+    return hits / total if total else None
@@ -0,0 +1,375 @@
+import discord
+import asyncio
+import os
+import time
+from cogs.track_queue import TrackQueue
+from cogs.metrics import FFMPEG_START_SECONDS, QUEUE_WAIT_SECONDS, TIME_TO_FIRST_AUDIO_SECONDS, PREFETCH_RESULTS
+
+# Lets FFmpeg recover from dropped connections when reading a remote stream
+FFMPEG_STREAM_OPTIONS = {
+    'before_options': '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5',
+    'options': '-vn',
+}
+
+
+# Per-guild music player: each guild gets its own queue, now-playing state,
+# preloader and idle deadline. Created on first use by the Voice cog and torn
+# down again when it goes idle, so only guilds that are playing cost anything.
+class GuildPlayer:
+    def __init__(self, cog, guild_id):
+        self.cog = cog
+        self.bot = cog.bot
+        self.guild_id = guild_id
+        self.song_queue = TrackQueue(key=lambda track: track.url)  # Track records, keyed by URL
+        self.current_song = None
+        self.preloaded_songs = {}  # url: (location, streamed, codec)
+        self.preload_tasks = {}  # url: task, preloads still running
+        self.queue_changed = asyncio.Event()  # wakes the preloader
+        self.ingest_tasks = set()  # !play requests still adding songs
+        self.next_source = None  # (url, source) opened ahead of time for the next song
+        self.preparing = None  # task resolving/downloading the song about to play
+        self.idle_timer = None  # handle for the pending idle disconnect, if any
+        self.voice_channel_id = None  # channel to rejoin instead of the requester's, when restored after a restart
+        self.queue_pages = (None, {})  # (queue version, {page: text}) rendered by !queue
+        self.audio_player_task = self.bot.loop.create_task(self.audio_player())
+        self.preloader_task = self.bot.loop.create_task(self.preload_songs())
+
+    @property
+    def guild(self):
+        return self.bot.get_guild(self.guild_id)
+
+    def is_active(self):
+        return self.current_song is not None or len(self.song_queue) > 0
+
+    # Stops this guild's background tasks and forgets the player
+    def destroy(self):
+        if self.cog.players.get(self.guild_id) is self:
+            del self.cog.players[self.guild_id]
+
+        current = asyncio.current_task()
+        self.cancel_ingest()
+        self.cancel_preparing()
+        self.cancel_idle_timer()
+        for task in (self.audio_player_task, self.preloader_task, *self.preload_tasks.values()):
+            if task is not current and not task.done():
+                task.cancel()
+        self.preload_tasks.clear()
+
+        self.preloaded_songs.clear()
+        self.discard_next_source()
+        self.current_song = None
+        self.cog.player_states.mark(self.guild_id)  # forget the saved state (kept if shutting down)
+
+    # State to restore after a restart: the voice channel, the current track and how far
+    # into it playback got, and the queue. None when there's nothing to come back to.
+    def snapshot(self):
+        if not self.is_active():
+            return None
+        guild = self.guild
+        voice = guild.voice_client if guild else None
+        current = None
+        if self.current_song is not None:
+            current = self.current_song.to_dict()
+            current["offset"] = round(self.current_song.position(), 1)
+        return {
+            "voice_channel_id": voice.channel.id if voice and voice.channel else None,
+            "current": current,
+            "queue": [track.to_dict() for track in self.song_queue],
+        }
+
+    # True when the bot is in a voice channel with no one but other bots
+    def is_alone(self):
+        guild = self.guild
+        voice = guild.voice_client if guild else None
+        if not voice or not voice.is_connected():
+            return False
+        return not any(not member.bot for member in voice.channel.members)
+
+    # Arms or clears this guild's idle deadline. Called on queue changes and voice state
+    # updates only, so nothing runs while a guild's state stays the same.
+    def update_idle(self):
+        if not self.is_alone() and self.is_active():
+            self.cancel_idle_timer()
+        elif self.idle_timer is None:
+            self.idle_timer = self.bot.loop.call_later(self.cog.timeout_duration, self.on_idle_timeout)
+
+    def cancel_idle_timer(self):
+        if self.idle_timer is not None:
+            self.idle_timer.cancel()
+            self.idle_timer = None
+
+    def on_idle_timeout(self):
+        self.idle_timer = None
+        self.bot.loop.create_task(self.disconnect_idle())
+
+    # Disconnects only this guild and tears the player down
+    async def disconnect_idle(self):
+        alone = self.is_alone()
+        guild = self.guild
+        voice = guild.voice_client if guild else None
+        if voice and voice.is_connected():
+            channel = voice.channel
+            await voice.disconnect()
+            if alone:
+                print(f"Disconnected from {channel.name} due to reaching inactivity timer while alone.")
+            else:
+                print(f"Disconnected from {guild.name} due to queue inactivity timeout.")
+        self.destroy()
+
+    # Runs a !play request in the background so the command returns right away
+    def start_ingest(self, coro):
+        task = self.bot.loop.create_task(coro)
+        self.ingest_tasks.add(task)
+        task.add_done_callback(self.ingest_tasks.discard)
+        return task
+
+    def cancel_ingest(self):
+        for task in list(self.ingest_tasks):
+            task.cancel()
+
+    # Drops the preparation of the song about to play (e.g. !skip before it started).
+    # Returns True if there was one.
+    def cancel_preparing(self):
+        if self.preparing is None or self.preparing.done():
+            return False
+        self.preparing.cancel()
+        return True
+
+    # requested_at is the !play time, given for the first track of a request
+    async def enqueue(self, track, requested_at=None):
+        track.queued_at = time.monotonic()
+        track.requested_at = requested_at
+        handle = self.song_queue.put(track, track.duration)
+        self.queue_changed.set()
+        self.update_idle()
+        return handle
+
+    # Removes the queued song at a 0-based position and returns it
+    def remove_at(self, index):
+        track = self.song_queue.remove(self.song_queue.handle_at(index))
+        self.queue_changed.set()
+        return track
+
+    def move(self, from_index, to_index):
+        self.song_queue.move(self.song_queue.handle_at(from_index), to_index)
+        self.queue_changed.set()
+
+    def shuffle(self):
+        self.song_queue.shuffle()
+        self.queue_changed.set()
+
+    def dedupe(self):
+        removed = self.song_queue.dedupe()
+        self.queue_changed.set()
+        return removed
+
+    def clear_queue(self):
+        self.cancel_ingest()
+        self.song_queue.clear()
+        self.discard_next_source()
+        self.queue_changed.set()
+
+    # Looks up the channel the song was requested from and sends a message there
+    async def send(self, track, content, **kwargs):
+        channel = self.bot.get_channel(track.channel_id)
+        if channel is None:
+            return
+        try:
+            await channel.send(content, **kwargs)
+        except discord.HTTPException as e:
+            print(f"Couldn't send to #{channel}: {e}")
+
+    # The voice channel the requester is in right now, if any
+    def requester_voice_channel(self, track):
+        guild = self.guild
+        member = guild.get_member(track.requester_id) if guild else None
+        if member is None or member.voice is None:
+            return None
+        return member.voice.channel
+
+    @staticmethod
+    # Opus audio is copied straight into Discord's Ogg/Opus stream; anything else is
+    # encoded to Opus by FFmpeg rather than decoded to PCM and encoded in Python
+    # bitrate (kbps) only matters when FFmpeg has to encode; offset (seconds) seeks
+    # into the track, e.g. to resume it after a restart
+    def create_source(location, streamed, codec, bitrate, offset=0):
+        ffmpeg_options = dict(FFMPEG_STREAM_OPTIONS) if streamed else {}
+        if offset:
+            ffmpeg_options['before_options'] = f"-ss {offset:.1f} {ffmpeg_options.get('before_options', '')}".strip()
+        with FFMPEG_START_SECONDS.time():
+            return discord.FFmpegOpusAudio(location, bitrate=bitrate, codec=codec, **ffmpeg_options)
+
+    # Starts FFmpeg for the next song while the current one is still playing, so it has
+    # audio buffered by the time it's needed. Only done once the next song is preloaded.
+    def preopen_next(self):
+        if self.next_source is not None or self.current_song is None or not self.song_queue:
+            return
+        url = self.song_queue.peek(1)[0].url
+        preloaded = self.preloaded_songs.get(url)
+        if not preloaded:
+            return
+        location, streamed, codec = preloaded
+        try:
+            bitrate = self.cog.target_bitrate(self.guild_id)
+            self.next_source = (url, self.create_source(location, streamed, codec, bitrate))
+        except Exception as e:
+            print(f"Couldn't pre-open {url}: {e}")
+
+    # Hands over the pre-opened source if it belongs to this song
+    def take_next_source(self, url):
+        if self.next_source is None:
+            return None
+        next_url, source = self.next_source
+        self.next_source = None
+        if next_url == url:
+            return source
+        source.cleanup()
+        return None
+
+    def discard_next_source(self):
+        if self.next_source is not None:
+            self.next_source[1].cleanup()
+            self.next_source = None
+
+    # Audio playback loop: handles queueing, downloading, and playing songs. A track that
+    # fails is reported and skipped; without a voice connection the player shuts down,
+    # rather than leaving a loop behind that no longer plays anything.
+    async def audio_player(self):
+        while True:
+            self.current_song = None
+            self.update_idle()
+            _, track = await self.song_queue.get()  # Wait for the next song in the queue
+            self.current_song = track
+            self.queue_changed.set()  # the lookahead window moved
+            self.update_idle()
+            try:
+                await self.play_track(track)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Failed to play {track.url} in guild {self.guild_id}: {e!r}")
+                guild = self.guild
+                voice = guild.voice_client if guild else None
+                if voice is not None and voice.is_connected():
+                    await self.send(track, f"❌ Couldn't play [{track.title}]({track.url}): {e}", suppress_embeds=True)
+                    continue
+                await self.send(track, f"❌ Couldn't play [{track.title}]({track.url}) without a voice connection "
+                                       f"({e}), stopping.", suppress_embeds=True)
+                if voice is not None:
+                    await voice.disconnect(force=True)
+                self.destroy()
+                return
+
+            self.current_song = None
+            self.cog.player_states.mark(self.guild_id)
+
+    # Connects if needed, gets the track's audio ready and plays it to the end
+    async def play_track(self, track):
+        url = track.url
+
+        # Connect to voice channel if not already connected or gives error if user who issued
+        # command is not in a voice channel
+        guild = self.guild
+        voice = guild.voice_client if guild else None
+        if not voice:
+            channel = guild.get_channel(self.voice_channel_id) if guild and self.voice_channel_id else None
+            channel = channel or self.requester_voice_channel(track)
+            if channel:
+                voice = await channel.connect()
+            else:
+                await self.send(track, "❌ You need to be in a voice channel to play music.")
+                return
+
+        # Use the source opened while the previous song played, otherwise
+        # resolve a stream URL or download the song
+        preloaded = self.preloaded_songs.pop(url, None)
+        if preloaded and not (preloaded[1] or os.path.exists(preloaded[0])):
+            preloaded = None  # downloaded file was evicted since
+        if preloaded is None and track.source and os.path.exists(track.source[0]):
+            preloaded = track.source  # restored after a restart with its cached file
+        source = self.take_next_source(url)
+        PREFETCH_RESULTS.inc(result="hit" if source is not None or preloaded else "miss")
+        if source is None:
+            if preloaded:
+                track.source = preloaded
+            else:
+                self.preparing = self.bot.loop.create_task(self.cog.prepare_song(url, self.guild_id))
+                try:
+                    await asyncio.wait({self.preparing})
+                except asyncio.CancelledError:
+                    self.cancel_preparing()
+                    raise
+                prepared, self.preparing = self.preparing, None
+                if prepared.cancelled():
+                    self.current_song = None  # skipped before it started
+                    return
+                try:
+                    track.source = prepared.result()
+                except Exception as e:
+                    await self.send(track, f"Error downloading: {e}")
+                    return
+            source = self.create_source(*track.source, self.cog.target_bitrate(self.guild_id), track.offset)
+
+        # Play the song; the after callback runs on the voice thread and wakes this loop
+        finished = asyncio.Event()
+
+        def after(error):
+            if error:
+                print(f"Playback error: {error}")
+            self.bot.loop.call_soon_threadsafe(finished.set)
+
+        try:
+            voice.play(source, after=after)
+        except Exception:
+            source.cleanup()
+            raise
+        now = track.started_at = time.monotonic()
+        if track.queued_at is not None:
+            QUEUE_WAIT_SECONDS.observe(now - track.queued_at)
+        if track.requested_at is not None:
+            TIME_TO_FIRST_AUDIO_SECONDS.observe(now - track.requested_at)
+        self.preopen_next()
+        self.cog.index_in_background(self.cog.track_index.add, track.title, url, track.duration, True)
+        await self.send(track, f"🔊 **Now Playing:** [{track.title}]({url})", suppress_embeds=True)
+
+        # Wait until the song is done before starting the next one
+        await finished.wait()
+
+    # Keeps the next PREFETCH_AHEAD songs ready. Runs only when the queue changes;
+    # the downloads themselves share the cog-wide prefetch concurrency limit.
+    async def preload_songs(self):
+        while True:
+            await self.queue_changed.wait()
+            self.queue_changed.clear()
+            self.cog.player_states.mark(self.guild_id)
+
+            # Look ahead into this guild's queue
+            upcoming = self.song_queue.peek(self.cog.prefetch_ahead)
+
+            # Forget preloads for songs that were removed from the queue, and stop
+            # the ones still running (the song now playing keeps its own)
+            playing_url = self.current_song.url if self.current_song else None
+            for url in list(self.preloaded_songs):
+                if not self.song_queue.contains(url):
+                    del self.preloaded_songs[url]
+            for url, task in list(self.preload_tasks.items()):
+                if not self.song_queue.contains(url) and url != playing_url:
+                    task.cancel()
+
+            for track in upcoming:
+                url = track.url
+                if url not in self.preloaded_songs and url not in self.preload_tasks:
+                    task = self.bot.loop.create_task(self.preload_song(url))
+                    self.preload_tasks[url] = task
+
+    async def preload_song(self, url):
+        try:
+            async with self.cog.prefetch_semaphore:
+                self.preloaded_songs[url] = await self.cog.prepare_song(url, self.guild_id)
+            self.preopen_next()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Preload error for {url}: {e}")
+        finally:
+            self.preload_tasks.pop(url, None)
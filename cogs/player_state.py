@@ -0,0 +1,44 @@
+import json
+import os
+import sqlite3
+
+from cogs.storage import WriteBehind
+
+PLAYER_STATE_DB = os.environ.get("PLAYER_STATE_DB", "player_state.db")
+CHECKPOINT_INTERVAL = 15.0  # how often playing guilds save their playback position
+
+
+# Saved player state, one row per guild, so queues survive a restart. Guilds are
+# marked dirty when their player changes and written behind (see WriteBehind). A
+# snapshot of None (player gone or idle) deletes the row.
+class PlayerStateStore(WriteBehind):
+    name = "player state"
+
+    def __init__(self, path, snapshot):
+        super().__init__()
+        self.snapshot = snapshot  # guild_id -> state dict, or None
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS player_state (guild_id INTEGER PRIMARY KEY, state TEXT NOT NULL)"
+            )
+
+    def load(self):
+        with self.write_lock:
+            rows = self.conn.execute("SELECT guild_id, state FROM player_state").fetchall()
+        return {guild_id: json.loads(state) for guild_id, state in rows}
+
+    def collect(self, guild_ids):
+        return {guild_id: self.snapshot(guild_id) for guild_id in guild_ids}
+
+    def save(self, guild_ids, states):
+        with self.conn:
+            for guild_id, state in states.items():
+                if state is None:
+                    self.conn.execute("DELETE FROM player_state WHERE guild_id = ?", (guild_id,))
+                else:
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO player_state (guild_id, state) VALUES (?, ?)",
+                        (guild_id, json.dumps(state)),
+                    )
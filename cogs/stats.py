@@ -0,0 +1,101 @@
+import discord
+import asyncio
+import os
+from aiohttp import web
+from discord.ext import commands
+from cogs.metrics import (
+    registry, hit_ratio, CACHE_REQUESTS, PREFETCH_RESULTS, VOICE_CONNECTIONS, ACTIVE_PLAYERS, LOOP_LAG_SECONDS,
+    EXTRACT_SECONDS, DOWNLOAD_SECONDS, EXTRACTOR_WAIT_SECONDS, FFMPEG_START_SECONDS, QUEUE_WAIT_SECONDS, TIME_TO_FIRST_AUDIO_SECONDS,
+    DISCORD_SEND_SECONDS,
+)
+
+# Prometheus endpoint, served on localhost only. METRICS_PORT=0 turns it off.
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9108"))
+LAG_CHECK_INTERVAL = 0.5  # seconds between event-loop lag samples
+
+
+def format_seconds(value):
+    if value is None:
+        return "-"
+    return f"{value * 1000:.0f}ms" if value < 1 else f"{value:.2f}s"
+
+
+def format_ratio(value):
+    return "-" if value is None else f"{value:.0%}"
+
+
+class Stats(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+        self.runner = None
+        self.lag_task = None
+        VOICE_CONNECTIONS.set_function(lambda: len(self.bot.voice_clients))
+        ACTIVE_PLAYERS.set_function(self.active_players)
+
+    def active_players(self):
+        voice = self.bot.get_cog("Voice")
+        return len(voice.players) if voice else 0
+
+    async def cog_load(self):
+        self.lag_task = asyncio.get_running_loop().create_task(self.measure_loop_lag())
+        if METRICS_PORT:
+            app = web.Application()
+            app.router.add_get("/metrics", self.metrics_handler)
+            self.runner = web.AppRunner(app, access_log=None)
+            await self.runner.setup()
+            try:
+                await web.TCPSite(self.runner, METRICS_HOST, METRICS_PORT).start()
+                print(f"Serving metrics on http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+            except OSError as e:
+                print(f"Couldn't start metrics endpoint: {e}")
+
+    async def cog_unload(self):
+        if self.lag_task:
+            self.lag_task.cancel()
+        if self.runner:
+            await self.runner.cleanup()
+
+    # Sleeps for a fixed interval and records how much later than asked it woke up
+    async def measure_loop_lag(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            before = loop.time()
+            await asyncio.sleep(LAG_CHECK_INTERVAL)
+            LOOP_LAG_SECONDS.observe(max(0.0, loop.time() - before - LAG_CHECK_INTERVAL))
+
+    async def metrics_handler(self, request):
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+    @commands.command()
+    @commands.has_permissions(administrator=True)
+    async def stats(self, ctx):
+        lines = ["📊 **Player stats** (p50 / p99, count)"]
+        for label, histogram in (
+            ("Extraction", EXTRACT_SECONDS),
+            ("Download", DOWNLOAD_SECONDS),
+            ("Extractor slot wait", EXTRACTOR_WAIT_SECONDS),
+            ("FFmpeg start", FFMPEG_START_SECONDS),
+            ("Queue wait", QUEUE_WAIT_SECONDS),
+            ("Time to first audio", TIME_TO_FIRST_AUDIO_SECONDS),
+            ("Discord send", DISCORD_SEND_SECONDS),
+            ("Event-loop lag", LOOP_LAG_SECONDS),
+        ):
+            lines.append(
+                f"**{label}:** {format_seconds(histogram.percentile(50))} / "
+                f"{format_seconds(histogram.percentile(99))}, {histogram.count}"
+            )
+
+        lines.append(
+            f"**Cache hits:** audio {format_ratio(hit_ratio(CACHE_REQUESTS, cache='audio'))}, "
+            f"metadata {format_ratio(hit_ratio(CACHE_REQUESTS, cache='metadata'))}, "
+            f"search {format_ratio(hit_ratio(CACHE_REQUESTS, cache='query'))}, "
+            f"track index {format_ratio(hit_ratio(CACHE_REQUESTS, cache='index'))}"
+        )
+        lines.append(f"**Prefetch hits:** {format_ratio(hit_ratio(PREFETCH_RESULTS))}")
+        lines.append(f"**Voice connections:** {VOICE_CONNECTIONS.get()} ({ACTIVE_PLAYERS.get()} active players)")
+        await ctx.send("\n".join(lines))
+
+
+async def setup(bot):
+    await bot.add_cog(Stats(bot))
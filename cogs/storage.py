@@ -1,23 +1,264 @@
+import asyncio
 import json
 import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
 
 LOG_FILE = 'log_channels.json'
+REQUEST_CHANNEL_FILE = 'allowed_channels.json'
+CLEANUP_CHANNEL_FILE = 'cleanup_channels.json'
 
-def load_log_channels():
-    if not os.path.exists(LOG_FILE):
-        return {}
-    with open(LOG_FILE, 'r') as f:
-        return json.load(f)
+# Set SETTINGS_BACKEND=sqlite to keep guild settings in SETTINGS_DB instead of the JSON files
+SETTINGS_BACKEND = os.environ.get('SETTINGS_BACKEND', 'json').lower()
+SETTINGS_DB = os.environ.get('SETTINGS_DB', 'guild_settings.db')
+
+WRITE_DELAY = 1.0  # seconds to batch changes before writing them out
 
-def save_log_channels(data):
-    with open(LOG_FILE, 'w') as f:
+
+# Writes JSON to a temp file and swaps it in, so readers never see a half-written file
+def write_json_atomic(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
         json.dump(data, f, indent=4)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+# Holds an exclusive lock on path + ".lock" across processes, so cluster workers
+# sharing the settings files take turns reading and writing them
+@contextmanager
+def file_lock(path):
+    with open(f"{path}.lock", 'a+') as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:  # LK_LOCK gives up after ~10 seconds; keep waiting
+                    pass
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def read_json(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+# One JSON file per setting, in the same {"guild_id": channel_id} format as before.
+# Saving re-reads the file under a lock and only applies this process's changed
+# guilds, so several processes (see cluster.py) can share the files without
+# overwriting each other's settings.
+class JsonBackend:
+    FILES = {
+        'log_channel': LOG_FILE,
+        'request_channel': REQUEST_CHANNEL_FILE,
+        'cleanup_channel': CLEANUP_CHANNEL_FILE,
+    }
+
+    def load(self):
+        return {key: read_json(path) for key, path in self.FILES.items()}
+
+    def save(self, changes, snapshot):
+        for key in {key for key, _ in changes}:
+            path = self.FILES[key]
+            with file_lock(path):
+                values = read_json(path)
+                for changed_key, guild_id in changes:
+                    if changed_key != key:
+                        continue
+                    value = snapshot[key].get(guild_id)
+                    if value is None:
+                        values.pop(guild_id, None)
+                    else:
+                        values[guild_id] = value
+                write_json_atomic(path, values)
+
+
+# SQLite table for bots in many guilds: only changed rows are written. WAL mode
+# lets cluster processes read while another one writes.
+class SqliteBackend:
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS guild_settings ("
+            "guild_id TEXT NOT NULL, key TEXT NOT NULL, value TEXT, "
+            "PRIMARY KEY (guild_id, key))"
+        )
+        self.conn.commit()
+
+    def load(self):
+        data = {key: {} for key in JsonBackend.FILES}
+        rows = self.conn.execute("SELECT guild_id, key, value FROM guild_settings").fetchall()
+        if not rows:
+            # First run: start from the existing JSON files
+            data = JsonBackend().load()
+            self.save({(key, guild_id) for key, values in data.items() for guild_id in values}, data)
+            return data
+        for guild_id, key, value in rows:
+            data.setdefault(key, {})[guild_id] = json.loads(value)
+        return data
+
+    def save(self, changes, snapshot):
+        with self.conn:
+            for key, guild_id in changes:
+                value = snapshot.get(key, {}).get(guild_id)
+                if value is None:
+                    self.conn.execute("DELETE FROM guild_settings WHERE guild_id = ? AND key = ?", (guild_id, key))
+                else:
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO guild_settings (guild_id, key, value) VALUES (?, ?, ?)",
+                        (guild_id, key, json.dumps(value)),
+                    )
+
+
+# Write-behind for state kept in memory. mark(item) records what changed; shortly
+# after, collect() snapshots the changed items on the event loop thread and save()
+# writes them from a worker thread, so batches of changes cost one write. Subclasses
+# provide collect(dirty) and save(dirty, data).
+class WriteBehind:
+    name = "state"  # for error messages
+
+    def __init__(self):
+        self.dirty = set()  # items changed but not written yet
+        self.flush_handle = None
+        self.write_lock = threading.Lock()
+        self.closed = False
+
+    def mark(self, item):
+        if self.closed:
+            return
+        self.dirty.add(item)
+        self.schedule_flush()
+
+    def schedule_flush(self):
+        if self.flush_handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()  # no event loop (scripts, shutdown): write straight away
+            return
+        self.flush_handle = loop.call_later(WRITE_DELAY, self.start_background_flush)
+
+    # Takes the snapshot on the event loop thread, then writes it from a worker thread
+    def start_background_flush(self):
+        self.flush_handle = None
+        dirty, data = self.take_changes()
+        if dirty:
+            asyncio.get_running_loop().create_task(asyncio.to_thread(self.write, dirty, data))
+
+    def take_changes(self):
+        dirty, self.dirty = self.dirty, set()
+        return dirty, self.collect(dirty)
+
+    def write(self, dirty, data, final=False):
+        with self.write_lock:
+            if self.closed and not final:
+                return  # an older snapshot; close() already wrote newer state
+            try:
+                self.save(dirty, data)
+            except Exception as e:
+                print(f"Failed to save {self.name}: {e}")
+                self.dirty |= dirty
+
+    # Writes pending changes synchronously, e.g. on shutdown
+    def flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        dirty, data = self.take_changes()
+        if dirty:
+            self.write(dirty, data)
+
+    # Last flush: also writes `items`, then ignores further changes, so state being
+    # torn down during shutdown doesn't overwrite what was just saved
+    def close(self, items=()):
+        if self.closed:
+            return
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        self.dirty |= set(items)
+        dirty, data = self.take_changes()
+        self.closed = True
+        self.write(dirty, data, final=True)
+
+
+# Per-guild settings loaded once and served from memory, written behind. In cluster
+# mode every guild belongs to exactly one process, so a process's in-memory copy
+# is authoritative for the guilds it serves.
+class GuildSettings(WriteBehind):
+    name = "guild settings"
+
+    def __init__(self, backend):
+        super().__init__()
+        self.backend = backend
+        self.data = backend.load()  # key: {guild_id: value}; dirty holds (key, guild_id) pairs
+
+    def get(self, guild_id, key):
+        return self.data.get(key, {}).get(str(guild_id))
+
+    def set(self, guild_id, key, value):
+        guild_id = str(guild_id)
+        values = self.data.setdefault(key, {})
+        if value is None:
+            values.pop(guild_id, None)
+        else:
+            values[guild_id] = value
+        self.mark((key, guild_id))
+
+    def collect(self, changes):
+        return {key: dict(self.data.get(key, {})) for key in {key for key, _ in changes}}
+
+    def save(self, changes, snapshot):
+        self.backend.save(changes, snapshot)
+
+
+def create_settings():
+    if SETTINGS_BACKEND == 'sqlite':
+        return GuildSettings(SqliteBackend(SETTINGS_DB))
+    return GuildSettings(JsonBackend())
+
+
+settings = create_settings()
+
 
 def get_log_channel_id(guild_id):
-    data = load_log_channels()
-    return data.get(str(guild_id))
+    return settings.get(guild_id, 'log_channel')
 
 def set_log_channel_id(guild_id, channel_id):
-    data = load_log_channels()
-    data[str(guild_id)] = channel_id
-    save_log_channels(data)
+    settings.set(guild_id, 'log_channel', channel_id)
+
+def get_request_channel_id(guild_id):
+    return settings.get(guild_id, 'request_channel')
+
+def set_request_channel_id(guild_id, channel_id):
+    settings.set(guild_id, 'request_channel', channel_id)
+
+def get_cleanup_channel_id(guild_id):
+    return settings.get(guild_id, 'cleanup_channel')
+
+def set_cleanup_channel_id(guild_id, channel_id):
+    settings.set(guild_id, 'cleanup_channel', channel_id)
@@ -0,0 +1,65 @@
+import os
+import time
+
+
+# One queued song. Only plain values are kept (IDs instead of the Context, its
+# message, author and channel), so a long queue doesn't keep Discord objects
+# alive; the text channel and the requester's voice channel are looked up when
+# the song is about to play. __slots__ keeps each record small (see
+# benchmarks/track_memory.py).
+class Track:
+    __slots__ = (
+        "title", "url", "duration",
+        "guild_id", "channel_id", "requester_id", "requester_name",
+        "source",  # (location, streamed, codec) once resolved
+        "queued_at", "requested_at",  # monotonic times, for the queue wait / time to first audio metrics
+        "offset", "started_at",  # where playback starts (seconds, for resuming) and when it did (monotonic)
+    )
+
+    def __init__(self, title, url, duration, guild_id, channel_id, requester_id, requester_name):
+        self.title = title
+        self.url = url
+        self.duration = duration
+        self.guild_id = guild_id
+        self.channel_id = channel_id
+        self.requester_id = requester_id
+        self.requester_name = requester_name
+        self.source = None
+        self.queued_at = None
+        self.requested_at = None
+        self.offset = 0
+        self.started_at = None
+
+    @classmethod
+    def from_context(cls, ctx, title, url, duration=None):
+        return cls(title, url, duration, ctx.guild.id, ctx.channel.id, ctx.author.id, ctx.author.name)
+
+    # Seconds played so far, counting from the resume offset
+    def position(self):
+        if self.started_at is None:
+            return self.offset
+        return self.offset + time.monotonic() - self.started_at
+
+    # Plain data for the saved player state. Downloaded files are kept so a restored
+    # track can play straight from the cache; stream URLs expire, so those aren't.
+    def to_dict(self):
+        data = {
+            "title": self.title, "url": self.url, "duration": self.duration,
+            "guild_id": self.guild_id, "channel_id": self.channel_id,
+            "requester_id": self.requester_id, "requester_name": self.requester_name,
+        }
+        if self.source and not self.source[1]:
+            data["file"], data["codec"] = self.source[0], self.source[2]
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        track = cls(data["title"], data["url"], data.get("duration"), data["guild_id"], data["channel_id"],
+                    data["requester_id"], data.get("requester_name"))
+        if data.get("file") and os.path.exists(data["file"]):
+            track.source = (data["file"], False, data.get("codec"))
+        track.offset = data.get("offset", 0)
+        return track
+
+    def __repr__(self):
+        return f"<Track {self.title!r} {self.url}>"
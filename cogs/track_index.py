@@ -0,0 +1,140 @@
+import re
+import sqlite3
+import threading
+import time
+
+# Words that say little about which song it is; ignored when judging how well a
+# search matches a title
+NOISE_WORDS = {
+    "official", "video", "music", "audio", "lyrics", "lyric", "hd", "hq", "4k", "mv",
+    "visualizer", "remastered", "remaster", "version", "feat", "ft", "the", "a", "an",
+}
+STRONG_MATCH_COVERAGE = 0.6  # share of a title's words a search must contain to be used without asking YouTube
+MIN_MATCH_WORDS = 2
+SEARCH_MAX_AGE = 14 * 24 * 60 * 60  # a remembered search is asked again after this long (seconds)
+
+
+def words(text):
+    return re.findall(r"\w+", text.lower())
+
+
+def normalize(term):
+    return " ".join(words(term))
+
+
+# Persistent full-text index (SQLite FTS5) of every track that was played or came
+# back from a search, plus the search terms that led to them. Lets !play <name>
+# resolve songs this bot has seen before without a YouTube search, and can answer
+# prefix searches (e.g. for autocomplete) without any network calls.
+#
+# Methods block on SQLite; the Voice cog calls them through asyncio.to_thread.
+class TrackIndex:
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS tracks ("
+                "id INTEGER PRIMARY KEY, url TEXT UNIQUE NOT NULL, title TEXT NOT NULL, "
+                "duration REAL, plays INTEGER NOT NULL DEFAULT 0, last_used REAL)"
+            )
+            self.conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS tracks_fts USING fts5(title)")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS searches ("
+                "term TEXT PRIMARY KEY, track_id INTEGER NOT NULL, hits INTEGER NOT NULL DEFAULT 0, resolved_at REAL)"
+            )
+            columns = [row[1] for row in self.conn.execute("PRAGMA table_info(searches)")]
+            if "resolved_at" not in columns:  # index created before searches expired
+                self.conn.execute("ALTER TABLE searches ADD COLUMN resolved_at REAL")
+
+    def add(self, title, url, duration=None, played=False):
+        with self.lock, self.conn:
+            return self._add(title, url, duration, played)
+
+    def _add(self, title, url, duration, played):
+        self.conn.execute(
+            "INSERT INTO tracks (url, title, duration, plays, last_used) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(url) DO UPDATE SET title = excluded.title, "
+            "duration = COALESCE(excluded.duration, duration), "
+            "plays = plays + excluded.plays, last_used = excluded.last_used",
+            (url, title, duration, int(played), time.time()),
+        )
+        track_id = self.conn.execute("SELECT id FROM tracks WHERE url = ?", (url,)).fetchone()[0]
+        self.conn.execute("INSERT OR REPLACE INTO tracks_fts (rowid, title) VALUES (?, ?)", (track_id, title))
+        return track_id
+
+    # Remembers that a search term resolved to this track
+    def add_search(self, term, title, url, duration=None):
+        term = normalize(term)
+        if not term:
+            return
+        with self.lock, self.conn:
+            track_id = self._add(title, url, duration, False)
+            self.conn.execute(
+                "INSERT INTO searches (term, track_id, resolved_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(term) DO UPDATE SET track_id = excluded.track_id, resolved_at = excluded.resolved_at",
+                (term, track_id, time.time()),
+            )
+
+    # Drops a track that can't be played any more (deleted, made private) along with
+    # the searches that led to it
+    def forget(self, url):
+        with self.lock, self.conn:
+            row = self.conn.execute("SELECT id FROM tracks WHERE url = ?", (url,)).fetchone()
+            if row is None:
+                return
+            self.conn.execute("DELETE FROM searches WHERE track_id = ?", row)
+            self.conn.execute("DELETE FROM tracks_fts WHERE rowid = ?", row)
+            self.conn.execute("DELETE FROM tracks WHERE id = ?", row)
+
+    # Returns (title, url, duration) when the index is confident about what the term
+    # refers to: the same search was resolved recently, or the term names most of a
+    # known title. Returns None otherwise, so the caller searches remotely.
+    def lookup(self, term):
+        term_words = words(term)
+        if not term_words:
+            return None
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT t.title, t.url, t.duration FROM searches s JOIN tracks t ON t.id = s.track_id "
+                "WHERE s.term = ? AND s.resolved_at > ?",
+                (" ".join(term_words), time.time() - SEARCH_MAX_AGE),
+            ).fetchone()
+            if row:
+                self.conn.execute("UPDATE searches SET hits = hits + 1 WHERE term = ?", (" ".join(term_words),))
+                self.conn.commit()
+                return row
+
+            wanted = set(term_words) - NOISE_WORDS
+            if len(wanted) < MIN_MATCH_WORDS:
+                return None
+            candidates = self.conn.execute(
+                "SELECT t.title, t.url, t.duration FROM tracks_fts f JOIN tracks t ON t.id = f.rowid "
+                "WHERE tracks_fts MATCH ? ORDER BY bm25(tracks_fts), t.plays DESC LIMIT 5",
+                (" ".join(f'"{word}"' for word in sorted(wanted)),),
+            ).fetchall()
+
+        for title, url, duration in candidates:
+            title_words = set(words(title)) - NOISE_WORDS
+            if title_words and len(wanted & title_words) / len(title_words) >= STRONG_MATCH_COVERAGE:
+                return title, url, duration
+        return None
+
+    # Known tracks whose titles contain every word of `prefix` (the last one as a
+    # prefix), most played first. Meant for autocomplete.
+    def search(self, prefix, limit=10):
+        prefix_words = words(prefix)
+        if not prefix_words:
+            return []
+        query = " ".join(f'"{word}"' for word in prefix_words) + "*"
+        with self.lock:
+            return self.conn.execute(
+                "SELECT t.title, t.url, t.duration FROM tracks_fts f JOIN tracks t ON t.id = f.rowid "
+                "WHERE tracks_fts MATCH ? ORDER BY t.plays DESC, bm25(tracks_fts) LIMIT ?",
+                (query, limit),
+            ).fetchall()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,118 @@
+import asyncio
+import itertools
+import random
+from collections import Counter, OrderedDict
+
+
+# Per-guild song queue. Every queued song gets a handle (an increasing int) that
+# stays valid while it's queued, so songs can be removed or moved without
+# scanning the queue. Positions (for !queue, !remove, !move) are looked up
+# through a list of handles that's rebuilt only after the queue changes.
+#
+# `key` picks out what counts as the same song (for dedupe and `contains`), and
+# the total duration of songs with a known length is kept as a running sum.
+class TrackQueue:
+    def __init__(self, key=None):
+        self.key = key or (lambda song: song)
+        self.entries = OrderedDict()  # handle: song, in play order
+        self.durations = {}  # handle: seconds, for songs with a known duration
+        self.key_counts = Counter()  # key: number of queued songs with it
+        self.total_duration = 0
+        self.version = 0  # bumped on every change, for caches of the queue's contents
+        self.handles = itertools.count(1)
+        self.order = None  # cached list of handles for indexed access
+        self.not_empty = asyncio.Event()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries.values())
+
+    def __getitem__(self, index):
+        return self.entries[self.handle_at(index)]
+
+    def changed(self):
+        self.version += 1
+        self.order = None
+        if self.entries:
+            self.not_empty.set()
+        else:
+            self.not_empty.clear()
+
+    def put(self, song, duration=None):
+        handle = next(self.handles)
+        self.entries[handle] = song
+        self.key_counts[self.key(song)] += 1
+        if duration:
+            self.durations[handle] = duration
+            self.total_duration += duration
+        self.changed()
+        return handle
+
+    # Waits for a song and takes it off the front. Returns (handle, song).
+    async def get(self):
+        while not self.entries:
+            await self.not_empty.wait()
+        handle = next(iter(self.entries))
+        return handle, self.remove(handle)
+
+    # The first `count` songs, without taking them off the queue
+    def peek(self, count):
+        return list(itertools.islice(self.entries.values(), count))
+
+    def contains(self, key):
+        return self.key_counts[key] > 0
+
+    def handle_at(self, index):
+        if self.order is None:
+            self.order = list(self.entries)
+        return self.order[index]
+
+    def remove(self, handle):
+        song = self.entries.pop(handle)
+        key = self.key(song)
+        self.key_counts[key] -= 1
+        if not self.key_counts[key]:
+            del self.key_counts[key]
+        self.total_duration -= self.durations.pop(handle, 0)
+        self.changed()
+        return song
+
+    # Moves a song to `index`. Moving to the front or the back is O(1).
+    def move(self, handle, index):
+        if index <= 0:
+            self.entries.move_to_end(handle, last=False)
+        elif index >= len(self.entries) - 1:
+            self.entries.move_to_end(handle)
+        else:
+            order = [other for other in self.entries if other != handle]
+            order.insert(index, handle)
+            self.entries = OrderedDict((other, self.entries[other]) for other in order)
+        self.changed()
+
+    def shuffle(self):
+        order = list(self.entries)
+        random.shuffle(order)
+        self.entries = OrderedDict((handle, self.entries[handle]) for handle in order)
+        self.changed()
+
+    # Drops later copies of songs that are already queued. Returns how many were removed.
+    def dedupe(self):
+        seen = set()
+        duplicates = []
+        for handle, song in self.entries.items():
+            key = self.key(song)
+            if key in seen:
+                duplicates.append(handle)
+            seen.add(key)
+        for handle in duplicates:
+            self.remove(handle)
+        return len(duplicates)
+
+    def clear(self):
+        self.entries.clear()
+        self.durations.clear()
+        self.key_counts.clear()
+        self.total_duration = 0
+        self.changed()
@@ -1,219 +1,599 @@
 import discord
 from discord.ext import commands
 from discord.ext.commands import check
-from cogs.storage import get_log_channel_id, set_log_channel_id
-import yt_dlp as youtube_dl
+from cogs.storage import get_request_channel_id, set_request_channel_id
+from cogs.log_sink import log_to_channel
+from cogs.player import GuildPlayer
+from cogs.track import Track
+from cogs.track_index import TrackIndex
+from cogs.player_state import PlayerStateStore, PLAYER_STATE_DB, CHECKPOINT_INTERVAL
+from cogs.audio_cache import AudioCache, remove_files
+from cogs.metadata import MetadataCache, SEARCH_TTL, PLAYLIST_TTL
+from cogs.metrics import cache_lookup, EXTRACT_SECONDS, DOWNLOAD_SECONDS
+from cogs.extractor import ExtractionEngine, extract_job, download_job, warm_job, DOWNLOAD_TIMEOUT
 import os
 import asyncio
 import time
-import uuid
-import json
-
-CONFIG_FILE = "allowed_channels.json" 
+import threading
+
+# Stream audio straight from the source URL instead of downloading and transcoding first.
+# Set STREAM_AUDIO=0 to always use the download path.
+STREAM_AUDIO = os.environ.get("STREAM_AUDIO", "1").lower() not in ("0", "false", "no")
+STREAMABLE_PROTOCOLS = ("http", "https", "m3u8", "m3u8_native")
+
+# Prefer Opus audio (YouTube's WebM audio formats) so it can be passed straight through to Discord
+AUDIO_FORMAT = 'bestaudio[acodec=opus]/bestaudio/best'
+OPUS_CONTAINERS = ("webm", "ogg", "opus")
+
+# Audio quality follows the voice channel's bitrate (64 kbps by default on Discord),
+# capped at AUDIO_BITRATE_CEILING kbps: there's no point fetching or encoding more
+# than the channel carries.
+AUDIO_BITRATE_CEILING = int(os.environ.get("AUDIO_BITRATE_CEILING", "160"))
+
+YDL_OPTIONS = {
+    'format': AUDIO_FORMAT,
+    'quiet': True,  # Suppress verbose logging
+    'default_search': 'ytsearch',  # Allow search terms
+    'noplaylist': True,
+}
+
+# Used by !play: playlists and searches only list their entries instead of resolving each one
+PLAYLIST_YDL_OPTIONS = {
+    'format': AUDIO_FORMAT,
+    'quiet': True,
+    'default_search': 'ytsearch',
+    'extract_flat': 'in_playlist',
+}
+
+# Prefetching: how many upcoming songs per guild to keep ready, and how many
+# prefetches may run at once across all guilds
+PREFETCH_AHEAD = int(os.environ.get("PREFETCH_AHEAD", "2"))
+PREFETCH_CONCURRENCY = int(os.environ.get("PREFETCH_CONCURRENCY", "3"))
+
+PROGRESS_EDIT_INTERVAL = 2.0  # seconds between edits of the playlist progress message
+QUEUE_PAGE_SIZE = 10  # tracks per !queue page, keeps a page well under Discord's message limit
+QUEUE_TITLE_LENGTH = 100
+
+# Searchable history of played tracks, used to resolve !play <name> without a YouTube search
+TRACK_INDEX_DB = os.environ.get("TRACK_INDEX_DB", "track_index.db")
+SEARCH_PREFIX = "ytsearch:"
+# yt-dlp errors that mean a video is gone for good (as opposed to a timeout, a network
+# error or rate limiting), so the track index can drop it
+UNAVAILABLE_ERRORS = ("video unavailable", "video is unavailable", "private video", "has been removed",
+                      "no longer available")
+
+# Where downloaded audio is kept. cluster.py gives each worker process its own directory.
+AUDIO_CACHE_DIR = os.environ.get("AUDIO_CACHE_DIR", "temp_music")
+# Size budget for downloaded audio kept in AUDIO_CACHE_DIR (AUDIO_CACHE_MB, default 1 GB)
+AUDIO_CACHE_MAX_BYTES = int(os.environ.get("AUDIO_CACHE_MB", "1024")) * 1024 * 1024
 
 # Utility to check if a string is a URL
 def is_url(string):
     return string.startswith("http://") or string.startswith("https://")
 
+# Format selector for downloads: the best audio at or under the target bitrate (Opus
+# first), otherwise the smallest audio above it
+def audio_format_for(kbps):
+    return (f'bestaudio[acodec=opus][abr<={kbps}]/bestaudio[abr<={kbps}]/'
+            'worstaudio[acodec=opus]/worstaudio/best')
+
+# Same choice for streaming, made from the formats of an already resolved video so a
+# different bitrate doesn't need another extraction. Returns the info itself (yt-dlp's
+# default pick) when it lists no usable audio-only formats.
+def pick_audio_format(info, kbps):
+    formats = [
+        f for f in info.get('formats') or ()
+        if f.get('url') and f.get('abr') and f.get('vcodec') == 'none'
+        and f.get('acodec') not in (None, 'none') and f.get('protocol') in STREAMABLE_PROTOCOLS
+    ]
+    if not formats:
+        return info
+    below = [f for f in formats if f['abr'] <= kbps]
+    if below:
+        return max(below, key=lambda f: (f.get('acodec') == 'opus', f['abr']))
+    return min(formats, key=lambda f: (f['abr'], f.get('acodec') != 'opus'))
+
+# Formats seconds as H:MM:SS or M:SS
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+# Downloaded files are Opus (.opus) unless they were cached before Opus passthrough
+def file_codec(filename):
+    return 'opus' if filename.endswith(".opus") else None
+
 def in_music_channel():
     def predicate(ctx):
-        cog = ctx.bot.get_cog("Voice")
-        if not cog:
+        if not ctx.guild:
             return False
 
-        guild_id = str(ctx.guild.id)
-        if guild_id not in cog.allowed_channels:
+        request_channel_id = get_request_channel_id(ctx.guild.id)
+        if request_channel_id is None:
             return False
 
-        return ctx.channel.id == cog.allowed_channels[guild_id]
+        return ctx.channel.id == request_channel_id
     return check(predicate)
 
-#  sends logs to Discord channel and terminal
-async def log_to_channel(client, guild, message, author_name=None):
-    log_channel_id = get_log_channel_id(guild.id)
-    log_channel = guild.get_channel(log_channel_id)
-
-    # Construct the message with or without author_name
-    if author_name:
-        formatted_message = f"{message} by User: **{author_name}**"
-    else:
-        formatted_message = message
-
-    # Send to Discord log channel if it exists
-    if log_channel:
-        await log_channel.send(formatted_message)
-
-    # Print to terminal with server name
-    if author_name:
-        print(f"{formatted_message} in Server: **{guild.name}**")
-    else:
-        print(f"{message} in Server: **{guild.name}**")
-
-
 class Voice(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.song_queue = asyncio.Queue()  # Queue to manage songs
-        self.current_song = None
-        self.audio_player_task = bot.loop.create_task(self.audio_player())  # Start the audio player loop
-        self.timeout_duration = 180  # time duration default 3 minutes
-        self.last_activity = time.time()
-        self.inactivity_check_task = bot.loop.create_task(self.inactivity_check())
-        self.temp_dir = "temp_music"
-        os.makedirs(self.temp_dir, exist_ok=True)
-        self.cache = {}
-        self.preloaded_songs = {}  # url: (title, filepath, ctx)
-        self.preloader_task = bot.loop.create_task(self.preload_songs())
-        self.allowed_channels = self.load_allowed_channels()
-
-
-    def load_allowed_channels(self):
+        self.players = {}  # guild_id: GuildPlayer, only for guilds with music activity
+        self.timeout_duration = 180  # idle/alone time before disconnecting, default 3 minutes
+        self.temp_dir = AUDIO_CACHE_DIR
+        self.cache = AudioCache(self.temp_dir, AUDIO_CACHE_MAX_BYTES)  # video key: downloaded file, kept across restarts
+        self.schedule_cache_cleanup(self.cache.untracked_files())  # leftovers from interrupted downloads
+        self.stream_audio = STREAM_AUDIO
+        self.metadata = MetadataCache()  # shared yt-dlp results for queries and videos
+        self.inflight = {}  # (kind, key): {"task", "waiters"}, shared by everyone waiting on the same work
+        self.extractor = ExtractionEngine()  # bounded pool for yt-dlp jobs
+        self.prefetch_ahead = PREFETCH_AHEAD
+        self.prefetch_semaphore = asyncio.Semaphore(PREFETCH_CONCURRENCY)
+        self.warmed_up = False
+        self.track_index = TrackIndex(TRACK_INDEX_DB)
+        self.player_states = PlayerStateStore(PLAYER_STATE_DB, self.player_snapshot)  # restored after a restart
+        self.checkpoint_task = self.bot.loop.create_task(self.checkpoint_players())
+
+
+    # Works out the cache key ("Extractor-videoid") from the URL alone, without a network call.
+    # Returns None when the URL doesn't identify a single video up front.
+    @staticmethod
+    def video_key(url):
+        if not is_url(url):
+            return None
+        from yt_dlp.extractor import gen_extractor_classes  # imported on first use, see warm_up
+        for ie in gen_extractor_classes():
+            if ie.ie_key() != 'Generic' and ie.suitable(url):
+                if getattr(ie, '_RETURN_TYPE', None) != 'video':
+                    return None  # a playlist/channel extractor, or one that may return either
+                video_id = ie.get_temp_id(url)
+                return f"{ie.ie_key()}-{video_id}" if video_id else None
+        return None
+
+    # Drops evicted files and rewrites the cache index in the background
+    def schedule_cache_cleanup(self, paths=()):
+        snapshot = self.cache.snapshot()
+
+        def cleanup():
+            remove_files(paths)
+            self.cache.save(snapshot)
+
+        self.bot.loop.create_task(asyncio.to_thread(cleanup))
+
+    # Runs make_coro() once per key: concurrent callers wait on the same task instead of
+    # starting duplicate work. Shielded so one caller giving up doesn't cancel it for the
+    # rest; once every caller has given up (skip, stop) the work itself is cancelled.
+    async def single_flight(self, key, make_coro):
+        flight = self.inflight.get(key)
+        if flight is None:
+            task = self.bot.loop.create_task(make_coro())
+            flight = self.inflight[key] = {"task": task, "waiters": 0}
+
+            def done(t):
+                if self.inflight.get(key) is flight:
+                    del self.inflight[key]
+                if not t.cancelled():
+                    t.exception()  # mark as retrieved even if every caller went away
+
+            task.add_done_callback(done)
+
+        flight["waiters"] += 1
         try:
-            with open(CONFIG_FILE, "r") as f:
-                return json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            return {}
-
-    def save_allowed_channels(self):
-        with open(CONFIG_FILE, "w") as f:
-            json.dump(self.allowed_channels, f, indent=4)
-
-
-    # Runs the blocking yt_dlp download in a separate thread to avoid freezing the event loop
-    async def download_song(self, url):
-        # Return cached file if already downloaded
-        if url in self.cache and os.path.exists(self.cache[url]):
-            return self.cache[url]
-
-        unique_id = str(uuid.uuid4())
-        filename_no_ext = os.path.join(self.temp_dir, f"song_{unique_id}") # Save with "song" as base filename
-        final_filename = f"{filename_no_ext}.mp3"
-        
+            return await asyncio.shield(flight["task"])
+        finally:
+            flight["waiters"] -= 1
+            if flight["waiters"] == 0 and not flight["task"].done():
+                flight["task"].cancel()
+
+    # Cache key for a URL: remembered from an earlier resolution, or worked out offline
+    async def cache_key(self, url):
+        return self.metadata.url_keys.get(url) or await asyncio.to_thread(self.video_key, url)
+
+    # Resolves a single video through the shared metadata cache, so !play, the preloader and
+    # the stream/download paths only run yt-dlp once per video while the stream URL is valid
+    async def resolve(self, url, guild_id=None):
+        return await self.single_flight(("resolve", url), lambda: self._resolve(url, guild_id))
+
+    async def _resolve(self, url, guild_id):
+        key = await self.cache_key(url)
+        info = self.metadata.get_video(key)
+        cache_lookup("metadata", info is not None)
+        if info:
+            return key, info
+
+        info = await self.extractor.run(extract_job, url, YDL_OPTIONS, guild_id=guild_id, histogram=EXTRACT_SECONDS)
+        key = self.metadata.add_video(url, info)
+        return key, info
+
+    # Runs the blocking yt_dlp download in the extraction pool to avoid freezing the event loop
+    async def download_song(self, url, guild_id=None, kbps=AUDIO_BITRATE_CEILING):
+        return await self.single_flight(("download", url), lambda: self._download_song(url, guild_id, kbps))
+
+    async def _download_song(self, url, guild_id, kbps):
+        # Return cached file if this video was already downloaded
+        key = await self.cache_key(url)
+        cached = self.cache.get(key) if key else None
+        if cached:
+            return cached
+
+        # The URL didn't give away the video ID, so resolve it before downloading
+        key, info = await self.resolve(url, guild_id)
+        cached = self.cache.get(key)
+        if cached:
+            return cached
+
+        return await self.single_flight(("file", key), lambda: self.download_file(key, info, guild_id, kbps))
+
+    # Downloads at the requesting channel's bitrate. The cached file is then reused
+    # for any channel, since a local file costs nothing more to play.
+    async def download_file(self, key, info, guild_id, kbps):
+        final_filename = self.cache.path_for(key, "opus")
+        filename_no_ext = final_filename[:-len(".opus")]
         ydl_opts = {
-            'format': 'bestaudio/best',
-            'outtmpl': f'{filename_no_ext}.%(ext)s',  
-            'default_search': 'ytsearch',  # Allow search terms
+            **YDL_OPTIONS,
+            'format': audio_format_for(kbps),
+            'outtmpl': f'{filename_no_ext}.%(ext)s',
             'postprocessors': [{
                 'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
-                'preferredquality': '192',
+                'preferredcodec': 'opus',  # remuxed without re-encoding when the source is already Opus
+                'preferredquality': str(kbps),
             }],
-            'quiet': True,  # Suppress verbose logging
         }
 
-        def run_ydl():
-            with youtube_dl.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([url])
+        async def download():
+            await self.extractor.run(download_job, info, ydl_opts, guild_id=guild_id, timeout=DOWNLOAD_TIMEOUT,
+                                     histogram=DOWNLOAD_SECONDS)
+            # Save in cache, evicting the least recently used files if over budget
+            evicted = self.cache.add(key, final_filename)
+            self.schedule_cache_cleanup(evicted)
+            return final_filename
+
+        # Cancelling (!skip, !stop) kills the download when the extractor can stop jobs.
+        # Otherwise it runs to the end anyway, so it still finishes into the cache.
+        if self.extractor.can_stop_jobs:
+            return await download()
+        task = self.bot.loop.create_task(download())
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return await asyncio.shield(task)
+
+    # Resolves the direct audio URL so FFmpeg can start playing without a download
+    async def stream_song(self, url, guild_id=None, kbps=AUDIO_BITRATE_CEILING):
+        _, info = await self.resolve(url, guild_id)
+        audio = pick_audio_format(info, kbps)
+        stream_url, protocol = audio.get('url'), audio.get('protocol')
+        if not stream_url or protocol not in STREAMABLE_PROTOCOLS:
+            raise ValueError(f"source can't be streamed (protocol: {protocol})")
+        codec = 'opus' if audio.get('acodec') == 'opus' and audio.get('ext') in OPUS_CONTAINERS else None
+        return stream_url, codec
+
+    # Whether a track from the track index can still be played: True if its file is cached
+    # or it still resolves (the player then reuses that resolution), False if yt-dlp says
+    # it's gone (deleted, made private), None if that couldn't be told right now.
+    async def still_playable(self, url, guild_id=None):
+        key = await self.cache_key(url)
+        if key and self.cache.get(key):
+            return True
+        try:
+            await self.resolve(url, guild_id)
+            return True
+        except Exception as e:
+            from yt_dlp.utils import DownloadError
+            message = str(e).lower()
+            if (isinstance(e, DownloadError) and "try again later" not in message
+                    and any(marker in message for marker in UNAVAILABLE_ERRORS)):
+                print(f"Indexed track {url} is no longer available: {e}")
+                return False
+            print(f"Couldn't check indexed track {url}, searching instead: {e}")
+            return None
+
+    # (title, url, duration) of a single video
+    async def resolve_song(self, url, guild_id=None):
+        _, info = await self.resolve(url, guild_id)
+        return info['title'], info.get('webpage_url') or url, info.get('duration')
+
+    # Target audio bitrate in kbps for a guild: its voice channel's bitrate, up to the ceiling
+    def target_bitrate(self, guild_id):
+        guild = self.bot.get_guild(guild_id)
+        voice = guild.voice_client if guild else None
+        channel = voice.channel if voice else None
+        bitrate = getattr(channel, "bitrate", None)
+        if not bitrate:
+            return AUDIO_BITRATE_CEILING
+        return max(8, min(AUDIO_BITRATE_CEILING, bitrate // 1000))
+
+    # Returns (location, streamed, codec): a direct stream URL when streaming is enabled and
+    # the source supports it, otherwise the path of a downloaded file. codec is 'opus' when
+    # the audio can be handed to Discord without re-encoding.
+    async def prepare_song(self, url, guild_id=None):
+        kbps = self.target_bitrate(guild_id)
+        return await self.single_flight(("prepare", url, kbps), lambda: self._prepare_song(url, guild_id, kbps))
+
+    async def _prepare_song(self, url, guild_id, kbps):
+        key = await self.cache_key(url)
+        cached = self.cache.get(key) if key else None
+        cache_lookup("audio", cached is not None)
+        if cached:
+            return cached, False, file_codec(cached)
+
+        if self.stream_audio:
+            try:
+                stream_url, codec = await self.stream_song(url, guild_id, kbps)
+                return stream_url, True, codec
+            except Exception as e:
+                print(f"Streaming unavailable for {url}, downloading instead: {e}")
+        filename = await self.download_song(url, guild_id, kbps)
+        return filename, False, file_codec(filename)
+
+    # Resolves a !play query and yields (title, url, duration) as soon as yt-dlp produces them.
+    # Playlists and searches are read flat and page by page, so the first entry arrives
+    # long before a big playlist is fully listed; each video is only resolved when it's
+    # about to play. A single video is resolved in the extraction pool, like the player does.
+    async def iter_songs(self, query, ttl, guild_id=None):
+        cached = self.metadata.queries.get(query)
+        cache_lookup("query", cached is not None)
+        if cached is not None:
+            for song in cached:
+                yield song
+            return
+
+        if query.startswith(SEARCH_PREFIX):
+            song = await asyncio.to_thread(self.track_index.lookup, query[len(SEARCH_PREFIX):])
+            if song:
+                playable = await self.still_playable(song[1], guild_id)
+                if playable is False:
+                    self.index_in_background(self.track_index.forget, song[1])
+                if not playable:
+                    song = None  # search YouTube again; the index is only pruned of gone videos
+            cache_lookup("index", song is not None)
+            if song:
+                yield tuple(song)
+                return
+
+        # Recognisably one video (no network call needed to tell): skip the listing
+        if is_url(query) and await self.cache_key(query):
+            song = await self.resolve_song(query, guild_id)
+            self.metadata.queries.set(query, [song], ttl=ttl)
+            yield song
+            return
 
-        # Offload blocking work to thread
-        await asyncio.to_thread(run_ydl)
+        loop = asyncio.get_running_loop()
+        results = asyncio.Queue()
+        stopped = threading.Event()
 
-        # Save in cache
-        self.cache[url] = final_filename
-        return final_filename
+        def produce(touch):
+            def emit(item):
+                touch()
+                loop.call_soon_threadsafe(results.put_nowait, item)
 
-    # Audio playback loop: handles queueing, downloading, and playing songs
-    async def audio_player(self):
-        while True:
             try:
-                self.current_song = await asyncio.wait_for(self.song_queue.get(), timeout=self.timeout_duration)  # Wait for the next song in the queue
-                title, url, ctx = self.current_song
-
-                # Connect to voice channel if not already connected or gives error if user who issued
-                # command is not in a voice channel
-                voice = ctx.voice_client
-                if not voice:
-                    if ctx.author.voice and ctx.author.voice.channel:
-                        voice = await ctx.author.voice.channel.connect()
-                    else:
-                        await ctx.send("❌ You need to be in a voice channel to play music.")
+                import yt_dlp
+                with yt_dlp.YoutubeDL(PLAYLIST_YDL_OPTIONS) as ydl:
+                    info = ydl.extract_info(query, download=False, process=False)
+                    if info.get('_type') not in ('playlist', 'multi_video'):
+                        emit(('video', None))  # resolved in the extraction pool, see below
+                        return
+                    for entry in info['entries']:
+                        if stopped.is_set():
+                            return
+                        if entry:
+                            emit(('entry', entry))
+            except Exception as e:
+                emit(('error', e))
+            finally:
+                emit(('done', None))
+
+        # A listing given up on (see ExtractionEngine.run_stream) never sends 'done'
+        def producer_done(task):
+            if not task.cancelled() and task.exception() is not None:
+                results.put_nowait(('error', task.exception()))
+
+        producer_task = loop.create_task(self.extractor.run_stream(produce, guild_id=guild_id))
+        producer_task.add_done_callback(producer_done)
+        songs = []
+        try:
+            while True:
+                kind, item = await results.get()
+                if kind == 'done':
+                    break
+                if kind == 'error':
+                    raise item
+                if kind == 'video':
+                    # Single video: resolved (and kept for the player) in the extraction pool
+                    song = await self.resolve_song(query, guild_id)
+                else:
+                    url = item.get('webpage_url') or item.get('url')
+                    if not url:
                         continue
+                    song = (item.get('title') or url, url, item.get('duration'))
+                songs.append(song)
+                yield song
+            self.metadata.queries.set(query, songs, ttl=ttl)
+            if query.startswith(SEARCH_PREFIX) and songs:
+                self.index_in_background(self.track_index.add_search, query[len(SEARCH_PREFIX):], *songs[0])
+        finally:
+            # Let the worker thread notice it should stop; don't wait on a slow page fetch
+            stopped.set()
+
+    # Queues everything a !play query resolves to. Runs as a background task on the
+    # player: the first track is queued (and starts playing) as soon as it's resolved,
+    # and the user gets one message that is edited to show progress.
+    async def ingest(self, ctx, player, query, ttl):
+        requested_at = time.monotonic()
+        status = None
+        count = 0
+        first = None
+        last_edit = 0
+
+        async def show(content):
+            try:
+                await status.edit(content=content)
+            except discord.HTTPException as e:
+                print(f"Couldn't update queue progress message: {e}")
 
-
-
-                # Download the song and get its filename
-                try:
-                    if url in self.preloaded_songs:
-                        title, filename, ctx = self.preloaded_songs.pop(url)
-                    else:
-                        try:
-                            filename = await self.download_song(url)
-                        except Exception as e:
-                            await ctx.send(f"Error downloading: {e}")
-                            continue
-
-                except Exception as e:
-                    await ctx.send(f"Error downloading: {e}")
-                    continue
-
-                # Play the song
-                voice.play(discord.FFmpegPCMAudio(filename), after=lambda e: print("Playback finished."))
-                message = await ctx.send(f"🔊 **Now Playing:** [{title}]({url})", suppress_embeds=True)
-
-
-                # Wait until the song is done before starting the next one
-                while voice.is_playing():
-                    await asyncio.sleep(1)
-    
-                self.current_song = None
-
-                # Clean up only if it's not cached
-                if url not in self.cache or self.cache[url] != filename:
-                    if os.path.exists(filename):
-                        os.remove(filename)
-
-            except asyncio.TimeoutError:
-                self.current_song = None
-                for vc in self.bot.voice_clients:
-                    if vc.is_connected():
-                        await vc.disconnect()
-                        print("Disconnected due to queue inactivity timeout.")
-                        self.cache.clear()
-                continue  # Stop the audio player loop
-
-    async def preload_songs(self):
+        try:
+            async for title, url, duration in self.iter_songs(query, ttl, ctx.guild.id):
+                track = Track.from_context(ctx, title, url, duration)
+                await player.enqueue(track, requested_at=requested_at if count == 0 else None)
+                count += 1
+                if first is None:
+                    first = (title, url)
+                    status = await ctx.send(f"🎶 **Queued:** [{title}]({url})", suppress_embeds=True)
+                    last_edit = time.monotonic()
+                elif time.monotonic() - last_edit >= PROGRESS_EDIT_INTERVAL:
+                    await show(f"🎶 **Queueing playlist…** `{count}` tracks added so far.")
+                    last_edit = time.monotonic()
+        except asyncio.CancelledError:
+            if count > 1:
+                await show(f"⏹️ **Stopped queueing after `{count}` tracks.**")
+            raise
+        except Exception as e:
+            await ctx.send(f"❌ **Error retrieving song: {e}**")
+            log_to_channel(self.bot, ctx.guild, f"**Error retrieving song: {e}**", author_name=ctx.author.name)
+            if count == 0:
+                return
+
+        if count == 0:
+            await ctx.send("❌ **No results found.**")
+        elif count == 1:
+            title, url = first
+            log_to_channel(self.bot, ctx.guild, f"**Added to Queue:** [{title}]({url})", author_name=ctx.author.name)
+        else:
+            title, url = first
+            await show(f"✅ **Added `{count}` tracks to the queue**, starting with [{title}]({url}).")
+            log_to_channel(self.bot, ctx.guild, f"✅ **Added `{count}` tracks to the queue.**", author_name=ctx.author.name)
+
+    # Returns this guild's player, creating it on first use
+    def get_player(self, guild):
+        player = self.players.get(guild.id)
+        if player is None:
+            player = GuildPlayer(self, guild.id)
+            self.players[guild.id] = player
+        return player
+
+    # Writes to the track index from a worker thread without holding anything up
+    def index_in_background(self, fn, *args):
+        async def write():
+            try:
+                await asyncio.to_thread(fn, *args)
+            except Exception as e:
+                print(f"Failed to update track index: {e}")
+        self.bot.loop.create_task(write())
+
+    def player_snapshot(self, guild_id):
+        player = self.players.get(guild_id)
+        return player.snapshot() if player else None
+
+    # Saves every guild's queue and playback position while the players still exist.
+    # Called on shutdown, before the voice connections go away.
+    def save_players(self):
+        self.player_states.close(list(self.players))
+        self.cache.save()
+
+    # Playback positions change without anything else happening, so playing guilds
+    # are saved every CHECKPOINT_INTERVAL seconds to bound what a crash loses
+    async def checkpoint_players(self):
         while True:
-            await asyncio.sleep(1)
-
-            # Look ahead into the queue
-            queue_list = list(self.song_queue._queue)
-            for title, url, ctx in queue_list:
-                if url not in self.preloaded_songs:
+            await asyncio.sleep(CHECKPOINT_INTERVAL)
+            for guild_id, player in self.players.items():
+                if player.current_song is not None:
+                    self.player_states.mark(guild_id)
+
+    # Rebuilds the players saved by the last run, all guilds at once so one slow voice
+    # connection doesn't hold up the rest. Guilds handled by another shard or cluster
+    # worker are left for that process.
+    async def restore_players(self):
+        try:
+            states = await asyncio.to_thread(self.player_states.load)
+        except Exception as e:
+            print(f"Failed to load saved player state: {e}")
+            return
+        restores = [
+            self.restore_player(guild, state)
+            for guild, state in ((self.bot.get_guild(guild_id), state) for guild_id, state in states.items())
+            if guild is not None and guild.id not in self.players
+        ]
+        restored = sum(await asyncio.gather(*restores))
+        if restored:
+            print(f"Restored {restored} players")
+
+    # Rejoins the saved voice channel and queues the interrupted song (from where it
+    # stopped) followed by the rest of the queue. Returns whether anything was restored.
+    # Without a voice channel to play in, the saved queue is dropped with one message;
+    # the requesters usually aren't in voice right after a restart to fall back on.
+    async def restore_player(self, guild, state):
+        try:
+            tracks = [Track.from_dict(data) for data in ([state["current"]] if state.get("current") else [])]
+            tracks += [Track.from_dict(data) for data in state.get("queue", [])]
+            if not tracks:
+                return False
+
+            channel = guild.get_channel(state["voice_channel_id"]) if state.get("voice_channel_id") else None
+            if guild.voice_client is None:
+                error = "the voice channel is gone" if channel is None else None
+                if channel is not None:
                     try:
-                        filename = await self.download_song(url)
-                        self.preloaded_songs[url] = (title, filename, ctx)
+                        await channel.connect()
                     except Exception as e:
-                        print(f"Preload error for {url}: {e}")
-
-    async def inactivity_check(self):
-        check_interval = 30  # How often to check for inactivity (in seconds)
-        inactivity_timer = 0
-
-        while True:
-            await asyncio.sleep(check_interval)
-
-            for guild in self.bot.guilds:
-                voice_client = guild.voice_client
-                if voice_client and voice_client.is_connected():
-                    channel = voice_client.channel
-                    members = [m for m in channel.members if not m.bot]
-
-                    is_alone = len(members) == 0
+                        error = e
+                if error is not None:
+                    print(f"Failed to rejoin voice in {guild.name}: {error}")
+                    self.player_states.mark(guild.id)  # no player, so the saved state is deleted
+                    text_channel = self.bot.get_channel(tracks[0].channel_id)
+                    if text_channel is not None:
+                        await text_channel.send(f"❌ Couldn't rejoin voice after a restart, so the queue of "
+                                                f"`{len(tracks)}` tracks was dropped.")
+                    return False
+
+            player = self.get_player(guild)
+            player.voice_channel_id = channel.id if channel is not None else None
+            for track in tracks:
+                await player.enqueue(track)
+            await player.send(tracks[0], f"♻️ **Resumed after a restart** with `{len(tracks)}` tracks.")
+            return True
+        except Exception as e:
+            print(f"Failed to restore the player in {guild.name}: {e}")
+            return False
 
-                    # Track idle time per guild using a custom attribute
-                    if not hasattr(voice_client, "inactivity_timer"):
-                        voice_client.inactivity_timer = 0
+    def cog_unload(self):
+        self.checkpoint_task.cancel()
+        self.save_players()
+        for player in list(self.players.values()):
+            player.destroy()
+        self.extractor.shutdown()
+        self.track_index.close()
+
+    # Runs once, the first time the bot is connected: restores saved players and warms up yt-dlp
+    @commands.Cog.listener()
+    async def on_ready(self):
+        if self.warmed_up:
+            return
+        self.warmed_up = True
+        await asyncio.gather(self.restore_players(), self.warm_up())
+
+    # yt-dlp is slow to import, so nothing imports it when the cog loads. Once the bot
+    # is connected it's imported here in the background (and in the extraction
+    # workers), so the first !play doesn't pay for it either.
+    async def warm_up(self):
+        started = time.perf_counter()
+        try:
+            await asyncio.gather(asyncio.to_thread(warm_job), self.extractor.warm_up())
+            print(f"yt-dlp warmed up in {time.perf_counter() - started:.2f}s")
+        except Exception as e:
+            print(f"Failed to warm up yt-dlp: {e}")
+
+    # Voice state changes drive the per-guild idle deadline: people joining or leaving
+    # the bot's channel, or the bot itself being disconnected
+    @commands.Cog.listener()
+    async def on_voice_state_update(self, member, before, after):
+        player = self.players.get(member.guild.id)
+        if player is None:
+            return
 
-                    if is_alone:
-                        voice_client.inactivity_timer += check_interval
-                    else:
-                        voice_client.inactivity_timer = 0
+        if member.id == self.bot.user.id and after.channel is None:
+            player.destroy()
+            return
 
-                    if voice_client.inactivity_timer >= self.timeout_duration:
-                        await voice_client.disconnect()
-                        print(f"Disconnected from {channel.name} due to reaching inactivity timer while alone.")
-                        voice_client.inactivity_timer = 0  # Reset
-                        self.cache.clear()
+        player.update_idle()
 
 
     @commands.command()
@@ -226,54 +606,20 @@ class Voice(commands.Cog):
         # Adds a song to the queue, by URL or search term.
         query = search if is_url(search) else f"ytsearch:{search}"
 
-        ydl_opts = {
-            'format': 'bestaudio/best',
-            'quiet': True,
-            'default_search': 'ytsearch',
-        }
-
-        try:
-            def get_info():
-                with youtube_dl.YoutubeDL(ydl_opts) as ydl:
-                    info = ydl.extract_info(query, download=False)
-                    if 'entries' in info:
-                        # Playlist: return all entries
-                        return [(entry['title'], entry['webpage_url']) for entry in info['entries']]
-                    else:
-                        # Single video
-                        return [(info['title'], info['webpage_url'])]
-
-
-            songs = await asyncio.to_thread(get_info)
-
-            for title, url in songs:
-                await self.song_queue.put((title, url, ctx))
-                msg = await ctx.send(f"🎶 **Queued:** [{title}]({url})", suppress_embeds=True)
-                #print(f"Song queued: {title} ({url}) by {ctx.author.name} in {ctx.guild.name}") # Log the song being queued
-                await log_to_channel(self.bot, ctx.guild, f"**Added to Queue:** [{title}]({url})", author_name=ctx.author.name)
-
-
-
-            
-            if len(songs) > 1:
-                await ctx.send(f"✅ **Added `{len(songs)}` tracks to the queue.**")
-                await log_to_channel(self.bot, ctx.guild, f"✅ **Added `{len(songs)}` tracks to the queue.**", author_name=ctx.author.name)
-                #print(f"✅ Added {len(songs)} tracks to the queue.")
-
-        except Exception as e:
-            await ctx.send(f"❌ **Error retrieving song: {e}**")
-            await log_to_channel(self.bot, ctx.guild, f"**Error retrieving song: {e}**", author_name=ctx.author.name)
-            #print(f"❌ Error retrieving song: {e}")
+        ttl = PLAYLIST_TTL if is_url(search) else SEARCH_TTL
+        player = self.get_player(ctx.guild)
+        player.start_ingest(self.ingest(ctx, player, query, ttl))
 
     @commands.command()
     @in_music_channel()
     async def now(self, ctx):
-        if self.current_song:
-            title, url, _ = self.current_song
+        player = self.players.get(ctx.guild.id)
+        if player and player.current_song:
+            title, url = player.current_song.title, player.current_song.url
             msg = await ctx.send(f"🎧 **Now Playing: [{title}]({url})**", suppress_embeds=True)
 
             # Log to Discord and terminal
-            await log_to_channel(self.bot, ctx.guild, f"**Now Playing: [{title}]({url})**", author_name=ctx.author.name)
+            log_to_channel(self.bot, ctx.guild, f"**Now Playing: [{title}]({url})**", author_name=ctx.author.name)
             #print(f"🎧 Now Playing: {title} ({url})")
         else:
             await ctx.send("Nothing is playing right now.")
@@ -282,39 +628,112 @@ class Voice(commands.Cog):
     @in_music_channel()
     async def skip(self, ctx): # Skips the current song. 
         voice = ctx.voice_client
+        player = self.players.get(ctx.guild.id)
         if voice and voice.is_playing():
             voice.stop()
-            self.preloaded_songs.clear()
-            self.current_song = None
+            skipped = True
+        else:
+            # Still being downloaded/resolved: cancel that instead
+            skipped = player is not None and player.cancel_preparing()
+
+        if skipped:
+            if player:
+                player.current_song = None
             await ctx.send("⏩ **Skipped the current song.**")
 
             # Log to Discord and terminal
-            await log_to_channel(self.bot, ctx.guild, "**Skipped the current song.**", author_name=ctx.author.name)
+            log_to_channel(self.bot, ctx.guild, "**Skipped the current song.**", author_name=ctx.author.name)
             #print("⏩ Skipped the current song.")
 
+    # One page of the Up Next list. Pages are cached until the queue changes, and only
+    # the requested page is rendered, so big playlists stay cheap to page through.
+    def queue_page(self, player, page):
+        version, pages = player.queue_pages
+        if version != player.song_queue.version:
+            pages = {}
+            player.queue_pages = (player.song_queue.version, pages)
+        if page not in pages:
+            start = (page - 1) * QUEUE_PAGE_SIZE
+            end = min(start + QUEUE_PAGE_SIZE, len(player.song_queue))
+            lines = []
+            for index in range(start, end):
+                track = player.song_queue[index]
+                lines.append(f"{index + 1}. [{track.title[:QUEUE_TITLE_LENGTH]}]({track.url})")
+            pages[page] = "\n".join(lines)
+        return pages[page]
+
     @commands.command()
     @in_music_channel()
-    async def queue(self, ctx): # Displays the currently playing song and queue. 
-        if self.song_queue.empty() and not self.current_song:
+    async def queue(self, ctx, page: int = 1): # Displays the currently playing song and a page of the queue.
+        player = self.players.get(ctx.guild.id)
+        if not player or not player.is_active():
             await ctx.send("Queue is empty.")
         else:
             lines = []
 
-            if self.current_song:
-                title, url, _ = self.current_song
-                lines.append(f"🎧 **Now Playing:** [{title}]({url})")
-
-            queue_list = list(self.song_queue._queue)
-            if queue_list:
-                lines.append("\n**Up Next:**")
-                lines += [f"{i+1}. [{song[0]}]({song[1]})" for i, song in enumerate(queue_list)]
+            if player.current_song:
+                track = player.current_song
+                lines.append(f"🎧 **Now Playing:** [{track.title}]({track.url})")
+
+            queued = len(player.song_queue)
+            if queued:
+                page_count = (queued + QUEUE_PAGE_SIZE - 1) // QUEUE_PAGE_SIZE
+                page = max(1, min(page, page_count))
+                summary = f"`{queued}` tracks"
+                if player.song_queue.total_duration:
+                    summary += f", {format_duration(player.song_queue.total_duration)}"
+                lines.append(f"\n**Up Next** ({summary}) — page {page}/{page_count}:")
+                lines.append(self.queue_page(player, page))
+                if page < page_count:
+                    lines.append(f"Use `!queue {page + 1}` for more.")
 
             await ctx.send("\n".join(lines), suppress_embeds=True)
 
             # Log to Discord and terminal
-            await log_to_channel(self.bot, ctx.guild, "**Showing Queue**", author_name=ctx.author.name)
+            log_to_channel(self.bot, ctx.guild, "**Showing Queue**", author_name=ctx.author.name)
             #print("📜 Showing Queue")
 
+    @commands.command()
+    @in_music_channel()
+    async def remove(self, ctx, position: int): # Removes the song at a queue position.
+        player = self.players.get(ctx.guild.id)
+        if not player or not 1 <= position <= len(player.song_queue):
+            await ctx.send("❌ There's no song at that position in the queue.")
+            return
+        track = player.remove_at(position - 1)
+        await ctx.send(f"🗑️ **Removed:** [{track.title}]({track.url})", suppress_embeds=True)
+        log_to_channel(self.bot, ctx.guild, f"**Removed [{track.title}]({track.url}) from the queue**", author_name=ctx.author.name)
+
+    @commands.command()
+    @in_music_channel()
+    async def move(self, ctx, position: int, new_position: int): # Moves a queued song to another position.
+        player = self.players.get(ctx.guild.id)
+        if not player or not 1 <= position <= len(player.song_queue):
+            await ctx.send("❌ There's no song at that position in the queue.")
+            return
+        new_position = max(1, min(new_position, len(player.song_queue)))
+        track = player.song_queue[position - 1]
+        player.move(position - 1, new_position - 1)
+        await ctx.send(f"↕️ **Moved** [{track.title}]({track.url}) **to position {new_position}.**", suppress_embeds=True)
+
+    @commands.command()
+    @in_music_channel()
+    async def shuffle(self, ctx): # Shuffles the queue.
+        player = self.players.get(ctx.guild.id)
+        if not player or not player.song_queue:
+            await ctx.send("Queue is empty.")
+            return
+        player.shuffle()
+        await ctx.send(f"🔀 **Shuffled `{len(player.song_queue)}` songs.**")
+        log_to_channel(self.bot, ctx.guild, "**Shuffled the queue**", author_name=ctx.author.name)
+
+    @commands.command()
+    @in_music_channel()
+    async def dedupe(self, ctx): # Removes repeated songs from the queue.
+        player = self.players.get(ctx.guild.id)
+        removed = player.dedupe() if player else 0
+        await ctx.send(f"🧹 **Removed `{removed}` duplicate songs from the queue.**")
+
     @commands.command()
     @in_music_channel()
     async def stop(self, ctx): # Stops playback and clears the queue.""      
@@ -322,17 +741,16 @@ class Voice(commands.Cog):
         if voice and voice.is_playing():
             voice.stop()
 
-        # Clear queue
-        while True:
-            try:
-                self.song_queue.get_nowait()
-            except asyncio.QueueEmpty:
-                break
+        # Clear this guild's queue and drop any download for the song about to play
+        player = self.players.get(ctx.guild.id)
+        if player:
+            player.clear_queue()
+            player.cancel_preparing()
 
         await ctx.send("**Stopped playback and cleared queue.**")
 
         # Log to Discord and terminal
-        await log_to_channel(self.bot, ctx.guild, "**Stopped playback and cleared queue.**", author_name=ctx.author.name)
+        log_to_channel(self.bot, ctx.guild, "**Stopped playback and cleared queue.**", author_name=ctx.author.name)
         #print("Stopped playback and cleared queue.")
 
 
@@ -342,21 +760,15 @@ class Voice(commands.Cog):
         voice = ctx.voice_client
         if voice and voice.is_connected():
             await voice.disconnect()
-            self.preloaded_songs.clear()
-            self.current_song = None
-            self.cache.clear()
-
-            removed = 0
-            for file in os.listdir(self.temp_dir):
-                if file.endswith(".mp3"):
-                    os.remove(os.path.join(self.temp_dir, file))
-                    removed += 1
+            player = self.players.get(ctx.guild.id)
+            if player:
+                player.destroy()
 
             #displays to user
             await ctx.send(f"👋 **Left the voice channel.**")
 
             # Log to Discord and terminal
-            await log_to_channel(self.bot, ctx.guild, f"**Left the voice channel via !leave. Removed {removed} temp files and cleared cache.**", author_name=ctx.author.name)
+            log_to_channel(self.bot, ctx.guild, "**Left the voice channel via !leave.**", author_name=ctx.author.name)
             #print("👋 Left the voice channel.")
 
     @commands.command()
@@ -368,25 +780,28 @@ class Voice(commands.Cog):
     @commands.command()
     @commands.has_permissions(administrator=True)
     async def clearcache(self, ctx):
-        self.cache.clear()
-        removed = 0
-        for file in os.listdir(self.temp_dir):
-            if file.endswith(".mp3"):
-                os.remove(os.path.join(self.temp_dir, file))
-                removed += 1
+        self.metadata.clear()
+        paths = self.cache.clear()
+        snapshot = self.cache.snapshot()
+
+        def cleanup():
+            removed = remove_files(paths)
+            self.cache.save(snapshot)
+            return removed
+
+        removed = await asyncio.to_thread(cleanup)
         await ctx.send(f"**🧹 Cleared cache and removed {removed} temp files.**")
-        self.preloaded_songs.clear()
+        for player in self.players.values():
+            player.preloaded_songs.clear()
 
     @commands.command(name="setrequestchannel")
     @commands.has_permissions(administrator=True)
     async def set_request_channel(self, ctx):
-        guild_id = str(ctx.guild.id)
-        self.allowed_channels[guild_id] = ctx.channel.id
-        self.save_allowed_channels()
+        set_request_channel_id(ctx.guild.id, ctx.channel.id)
         await ctx.send(f"✅ This channel (`{ctx.channel.name}`) is now the music request channel.")
 
         # Log to Discord and terminal
-        await log_to_channel(self.bot, ctx.guild, f"✅ Set request channel to {ctx.channel.name}.", author_name=ctx.author.name)
+        log_to_channel(self.bot, ctx.guild, f"✅ Set request channel to {ctx.channel.name}.", author_name=ctx.author.name)
         print(f"✅ Set request channel to {ctx.channel.name}.")
 
 